@@ -0,0 +1,413 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Aggregator Benchmark
+# Path: /monitoring/oculus_sentry/aggregator_bench.py
+#
+# Drives log_aggregator.OculusSentry with UDP syslog and NetFlow v5 traffic
+# against local stand-ins for Elasticsearch and Mongo, then reports ingest
+# rate, drops, ingest-to-store latency and memory. Linux only (reads /proc).
+#
+#   python aggregator_bench.py --rate 20000 --syslog-share 0.7 --duration 30
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import urlopen
+
+from pymongo.errors import OperationFailure
+
+from netflow_collector import V5_HEADER, V5_RECORD
+
+BENCH_STAMP = re.compile(r'bench_t=(\d+\.\d+)')
+FLOWS_PER_PACKET = 30
+TICK = 0.01
+# Syslog worker processes build their own OculusSentry from the config file,
+# with a real MongoClient, so the Mongo stand-in would never see their writes
+WORKERS_UNSUPPORTED = ("syslog_workers > 1 is not supported by the benchmark; "
+                       "measure a single worker or benchmark against a real Mongo")
+EPOCH = datetime(1970, 1, 1)
+
+
+def sent_time(document):
+    """Send time the generator stamped into an event, or None"""
+    match = BENCH_STAMP.search(document.get('message') or '')
+    if match:
+        return float(match.group(1))
+    if document.get('type') == 'netflow' and document.get('timestamp'):
+        return (datetime.fromisoformat(document['timestamp']) - EPOCH).total_seconds()
+    return None
+
+
+class LatencyRecorder:
+    """Thread-safe store-time bookkeeping for one sink"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.stored = 0
+
+    def record(self, documents, now=None):
+        now = now or time.time()
+        latencies = []
+        for document in documents:
+            sent = sent_time(document)
+            if sent is not None:
+                latencies.append(now - sent)
+        with self.lock:
+            self.stored += len(latencies)
+            self.latencies.extend(latencies)
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stored = self.stored
+        return {
+            'stored': stored,
+            'p50_ms': _percentile(latencies, 0.50),
+            'p99_ms': _percentile(latencies, 0.99),
+            'max_ms': round(latencies[-1] * 1000, 2) if latencies else None
+        }
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)
+    return round(ordered[max(index, 0)] * 1000, 2)
+
+
+# -- Elasticsearch stand-in (separate process) ------------------------------
+
+class BulkSinkHandler(BaseHTTPRequestHandler):
+    """Just enough of the ES HTTP API for the Python client's bulk helper"""
+
+    recorder = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, body, status=200):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        # The 7.14+ client refuses to talk to a server without this header
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_HEAD(self):
+        self._reply({})
+
+    def do_GET(self):
+        if self.path.startswith('/_bench/stats'):
+            self._reply(self.recorder.summary())
+            return
+        self._reply({
+            'name': 'bench-sink',
+            'cluster_name': 'aggregator-bench',
+            'version': {'number': '7.17.0', 'build_flavor': 'default'},
+            'tagline': 'You Know, for Search'
+        })
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if '_bulk' not in self.path:
+            self._reply({'acknowledged': True})
+            return
+
+        now = time.time()
+        lines = body.splitlines()
+        items = []
+        documents = []
+        for action_line, source_line in zip(lines[0::2], lines[1::2]):
+            action = json.loads(action_line)
+            op, meta = next(iter(action.items()))
+            documents.append(json.loads(source_line))
+            items.append({op: {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 201}})
+        self.recorder.record(documents, now)
+        self._reply({'took': 1, 'errors': False, 'items': items})
+
+
+def run_es_stand_in(port, ready):
+    BulkSinkHandler.recorder = LatencyRecorder()
+    server = ThreadingHTTPServer(('127.0.0.1', port), BulkSinkHandler)
+    server.daemon_threads = True
+    ready.set()
+    server.serve_forever()
+
+
+# -- Mongo stand-in (in process) ---------------------------------------------
+
+class FakeCursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        return self
+
+
+class FakeResult:
+    upserted_id = None
+    modified_count = 0
+
+
+class FakeCollection:
+    """Accepts the calls the aggregator makes; only event inserts are timed"""
+
+    def __init__(self, database, name, recorder=None):
+        self.database = database
+        self.name = name
+        self.recorder = recorder
+        self.count = 0
+
+    def insert_many(self, documents, ordered=True):
+        documents = list(documents)
+        if self.recorder is not None:
+            self.recorder.record(documents)
+        self.count += len(documents)
+        return FakeResult()
+
+    def insert_one(self, document):
+        self.count += 1
+        return FakeResult()
+
+    def update_many(self, *args, **kwargs):
+        return FakeResult()
+
+    def bulk_write(self, operations, ordered=True):
+        return FakeResult()
+
+    def find_one_and_update(self, *args, **kwargs):
+        return {'_id': f"{self.name}-{self.count}"}
+
+    def find(self, *args, **kwargs):
+        return FakeCursor()
+
+    def create_index(self, keys, name=None, **kwargs):
+        # Mirror the server: partial indexes reject {'$exists': False}
+        for condition in kwargs.get('partialFilterExpression', {}).values():
+            if isinstance(condition, dict) and condition.get('$exists') is False:
+                raise OperationFailure('$exists: false is not supported in partial indexes', 67)
+        return name
+
+    def index_information(self):
+        return {}
+
+
+class FakeDatabase:
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            recorder = self.recorder if name == 'events' else None
+            self.collections[name] = FakeCollection(self, name, recorder)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def command(self, *args, **kwargs):
+        return {'ok': 1, 'inprog': []}
+
+
+class FakeMongoClient:
+    def __init__(self, recorder):
+        self.databases = {}
+        self.recorder = recorder
+
+    def __getitem__(self, name):
+        if name not in self.databases:
+            self.databases[name] = FakeDatabase(self, self.recorder)
+        return self.databases[name]
+
+    @property
+    def admin(self):
+        return self['admin']
+
+
+# -- Traffic generator (separate process) ------------------------------------
+
+def _syslog_packet(seq):
+    stamp = time.strftime('%b %d %H:%M:%S', time.gmtime())
+    return f"<38>{stamp} benchhost sshd[4242]: bench_t={time.time():.6f} seq={seq}".encode()
+
+
+def _netflow_packet(records, sequence):
+    now = time.time()
+    secs = int(now) + 1
+    uptime = 10 ** 9
+    # The decoder derives the flow time as secs - (uptime - last) / 1000, so
+    # choosing "last" this way carries the send time at millisecond precision
+    last = uptime - round((secs - now) * 1000)
+    body = b''.join(
+        V5_RECORD.pack(src, dst, b'\0' * 4, 0, 0, packets, octets, last, last,
+                       sport, dport, 0, 0x18, 6, 0, 0, 0, 0, 0, 0)
+        for src, dst, sport, dport, packets, octets in records
+    )
+    return V5_HEADER.pack(5, len(records), uptime, secs, 0, sequence, 0, 0, 0) + body
+
+
+def run_generator(host, syslog_port, netflow_port, rate, syslog_share, duration, results):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sources = [socket.inet_aton(f"10.0.{i // 250}.{i % 250 + 1}") for i in range(2000)]
+    targets = [socket.inet_aton(f"192.168.{i // 250}.{i % 250 + 1}") for i in range(500)]
+    flows = [
+        (random.choice(sources), random.choice(targets), random.randint(1024, 65535),
+         random.choice((22, 53, 80, 443, 3389)), random.randint(1, 100), random.randint(100, 100000))
+        for _ in range(FLOWS_PER_PACKET * 64)
+    ]
+
+    sent = {'syslog': 0, 'netflow': 0}
+    syslog_rate = rate * syslog_share
+    netflow_rate = rate - syslog_rate
+    start = time.time()
+    deadline = start + duration
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        elapsed = now - start
+        # Catch up to the schedule rather than sleeping a fixed amount, so
+        # send cost does not lower the achieved rate
+        for _ in range(int(syslog_rate * elapsed) - sent['syslog']):
+            sock.sendto(_syslog_packet(sent['syslog']), (host, syslog_port))
+            sent['syslog'] += 1
+        while sent['netflow'] + FLOWS_PER_PACKET <= netflow_rate * elapsed:
+            offset = sent['netflow'] % (len(flows) - FLOWS_PER_PACKET)
+            packet = _netflow_packet(flows[offset:offset + FLOWS_PER_PACKET], sent['netflow'])
+            sock.sendto(packet, (host, netflow_port))
+            sent['netflow'] += FLOWS_PER_PACKET
+        time.sleep(TICK)
+
+    sent['elapsed'] = time.time() - start
+    results.put(sent)
+
+
+# -- Harness -----------------------------------------------------------------
+
+def _free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _fetch_json(url):
+    with urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+
+def _memory():
+    usage = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                name, value = line.split(':', 1)
+                usage['rss_mb' if name == 'VmRSS' else 'peak_rss_mb'] = round(int(value.split()[0]) / 1024, 1)
+    return usage
+
+
+def run_benchmark(rate=10000, syslog_share=0.7, duration=30, drain=5, overrides=None):
+    if (overrides or {}).get('syslog_workers', 1) > 1:
+        raise ValueError(WORKERS_UNSUPPORTED)
+    from log_aggregator import OculusSentry
+
+    es_port = _free_port()
+    syslog_port = _free_port(socket.SOCK_DGRAM)
+    netflow_port = _free_port(socket.SOCK_DGRAM)
+    context = multiprocessing.get_context('spawn')
+
+    ready = context.Event()
+    es_process = context.Process(target=run_es_stand_in, args=(es_port, ready), daemon=True)
+    es_process.start()
+    if not ready.wait(10):
+        raise RuntimeError("Elasticsearch stand-in did not start")
+
+    config = {
+        'elasticsearch_hosts': [f"http://127.0.0.1:{es_port}"],
+        'mongo_uri': 'mongodb://bench',
+        'mongo_db': 'aegis_bench',
+        'metrics_port': _free_port(),
+        'syslog_port': syslog_port,
+        'netflow_port': netflow_port
+    }
+    config.update(overrides or {})
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(config, f)
+        config_file = f.name
+
+    mongo_recorder = LatencyRecorder()
+    sentry = OculusSentry(config_file, mongo_client=FakeMongoClient(mongo_recorder))
+    sentry_thread = threading.Thread(target=sentry.start_monitoring, daemon=True)
+    sentry_thread.start()
+    time.sleep(1)
+
+    results = context.Queue()
+    generator = context.Process(
+        target=run_generator,
+        args=('127.0.0.1', syslog_port, netflow_port, rate, syslog_share, duration, results)
+    )
+    generator.start()
+    sent = results.get()
+    generator.join()
+    time.sleep(drain)
+
+    memory = _memory()
+    sentry.running = False
+    sentry_thread.join(15)
+
+    es_stats = _fetch_json(f"http://127.0.0.1:{es_port}/_bench/stats")
+    es_process.terminate()
+    os.unlink(config_file)
+
+    total = sent['syslog'] + sent['netflow']
+    report = {
+        'offered_rate': rate,
+        'syslog_share': syslog_share,
+        'sent': total,
+        'sent_rate': round(total / sent['elapsed']),
+        'sinks': {}
+    }
+    for name, stats in (('elasticsearch', es_stats), ('mongo', mongo_recorder.summary())):
+        stats['ingest_rate'] = round(stats['stored'] / sent['elapsed'])
+        stats['drop_rate'] = round(1 - stats['stored'] / total, 4) if total else 0.0
+        report['sinks'][name] = stats
+    report.update(memory)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Oculus Sentry log aggregator')
+    parser.add_argument('--rate', type=int, default=10000, help='events per second offered')
+    parser.add_argument('--syslog-share', type=float, default=0.7,
+                        help='fraction of events sent as syslog; the rest are NetFlow v5 flows')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of traffic')
+    parser.add_argument('--drain', type=float, default=5, help='seconds to wait for writers afterwards')
+    parser.add_argument('--config', help='JSON file of aggregator config overrides')
+    args = parser.parse_args()
+
+    overrides = None
+    if args.config:
+        with open(args.config) as f:
+            overrides = json.load(f)
+        if overrides.get('syslog_workers', 1) > 1:
+            parser.error(WORKERS_UNSUPPORTED)
+    report = run_benchmark(args.rate, args.syslog_share, args.duration, args.drain, overrides)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Alert Suppression Cache
+# Path: /monitoring/oculus_sentry/alert_suppressor.py
+from collections import OrderedDict
+
+
+class AlertSuppressor:
+    """Collapse repeated alerts for the same rule and entity.
+
+    The first alert for a ``(rule, entity)`` pair is emitted as usual. Repeats
+    seen within ``window`` seconds of the previous one are folded into it,
+    bumping ``count`` and ``last_seen``. Once the pair goes quiet for a full
+    window (or has been open for ``max_duration``) the entry is closed and,
+    if anything was folded in, the aggregated alert is handed back so it can
+    overwrite the original document.
+
+    Entries are kept in last-seen order, so TTL expiry and LRU eviction both
+    pop from the front of the same OrderedDict.
+    """
+
+    def __init__(self, window=300, max_duration=3600, max_entries=50000, metrics=None):
+        self.window = window
+        self.max_duration = max_duration
+        self.max_entries = max_entries
+        self.metrics = metrics
+        self.entries = OrderedDict()
+
+    def offer(self, alert, entity, now):
+        """Return ``(alert_to_emit, closed_summaries)`` for a new alert.
+
+        ``alert_to_emit`` is None when the alert was folded into an open entry.
+        """
+        closed = self.expire(now)
+        key = (alert['rule'], entity)
+        entry = self.entries.get(key)
+
+        if entry is not None and now - entry['started'] >= self.max_duration:
+            closed.append(self._close(key))
+            entry = None
+
+        if entry is not None:
+            summary = entry['alert']
+            summary['count'] += 1
+            summary['last_seen'] = alert['last_seen']
+            entry['seen'] = now
+            self.entries.move_to_end(key)
+            self._count('alerts_suppressed', alert['rule'])
+            return None, [c for c in closed if c]
+
+        self.entries[key] = {'alert': alert, 'started': now, 'seen': now}
+        if len(self.entries) > self.max_entries:
+            evicted_key = next(iter(self.entries))
+            closed.append(self._close(evicted_key))
+            if self.metrics:
+                self.metrics['suppression_evictions'].inc()
+        self._count('alerts_emitted', alert['rule'])
+        return alert, [c for c in closed if c]
+
+    def expire(self, now):
+        """Close entries idle for a full window and return their summaries"""
+        closed = []
+        cutoff = now - self.window
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry['seen'] > cutoff:
+                break
+            summary = self._close(key)
+            if summary:
+                closed.append(summary)
+        return closed
+
+    def flush(self):
+        """Close every open entry, e.g. on shutdown"""
+        closed = [self._close(key) for key in list(self.entries)]
+        return [c for c in closed if c]
+
+    def _close(self, key):
+        entry = self.entries.pop(key)
+        alert = entry['alert']
+        return alert if alert['count'] > 1 else None
+
+    def _count(self, name, rule):
+        if self.metrics:
+            self.metrics[name].labels(rule=rule).inc()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,199 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Bulk Writer
+# Path: /monitoring/oculus_sentry/bulk_writer.py
+import logging
+import queue
+import threading
+import time
+
+
+class PartialWriteError(Exception):
+    """Raised by a flush function when some items of a batch must be retried.
+
+    ``items`` is the subset to write again (in batch order), ``written``
+    how many events of the batch were stored.
+    """
+
+    def __init__(self, message, items, written=0):
+        super().__init__(message)
+        self.items = items
+        self.written = written
+
+
+class BulkWriter:
+    """Bounded queue drained in batches by dedicated writer threads.
+
+    ``submit`` never blocks the caller: when the queue is full the item is
+    dropped and counted. Writers hand ``flush_fn`` a list once ``batch_size``
+    items are waiting or ``flush_interval`` seconds have passed since the
+    first item of the batch arrived, whichever comes first. ``flush_fn`` may
+    return how many items it actually wrote when a batch mixes in control
+    items.
+
+    With a ``spool``, a full queue or a failed flush moves the writer into
+    spilling mode instead of dropping: the failed batch, whatever is still
+    queued and every item submitted from then on go to disk in order, and
+    the writer replays the spool, backing off while the sink keeps failing.
+    Spilling ends once the spool is empty, so items never overtake each
+    other (acks stay behind their events). A PartialWriteError spools only
+    the items it names. Replays retry whole batches, so sinks must write
+    idempotently. Only a spool at its size cap drops items.
+    """
+
+    def __init__(self, name, flush_fn, queue_size=50000, batch_size=1000,
+                 flush_interval=1.0, workers=1, metrics=None, logger=None,
+                 spool=None, max_backoff=30.0):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.workers = workers
+        self.metrics = metrics
+        self.logger = logger or logging.getLogger('BulkWriter')
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.running = False
+        self.threads = []
+        self.spool = spool
+        self.max_backoff = max_backoff
+        self.backoff = 0
+        self.spill_lock = threading.Lock()
+        self.replay_lock = threading.Lock()
+        self.spilling = spool is not None and not spool.empty()
+
+        if metrics:
+            metrics['queue_depth'].labels(sink=name).set_function(self.queue.qsize)
+            self._dropped = metrics['events_dropped'].labels(sink=name)
+            self._written = metrics['events_written'].labels(sink=name)
+            if spool is not None:
+                self._spooled = metrics['events_spooled'].labels(sink=name)
+                metrics['spool_bytes'].labels(sink=name).set_function(lambda: spool.pending_bytes)
+                metrics['spool_age'].labels(sink=name).set_function(spool.age)
+
+    def start(self):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=10):
+        """Stop accepting work and drain what is already queued"""
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout)
+        if self.spool is not None:
+            self.spool.close()
+
+    def submit(self, item):
+        if self.spool is not None:
+            return self._submit_spooled(item)
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            if self.metrics:
+                self._dropped.inc()
+            return False
+
+    def _submit_spooled(self, item):
+        # The lock orders this against the writer entering or leaving
+        # spilling mode, so an item can never land behind later ones
+        with self.spill_lock:
+            if not self.spilling:
+                try:
+                    self.queue.put_nowait(item)
+                    return True
+                except queue.Full:
+                    self._start_spilling([])
+            return self._spill([item])
+
+    def _start_spilling(self, batch):
+        """Move ``batch`` and everything still queued to the spool; call with spill_lock held"""
+        self.spilling = True
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._spill(batch)
+
+    def _spill(self, items):
+        stored = self.spool.append(items)
+        if self.metrics:
+            if stored:
+                self._spooled.inc(len(items))
+            else:
+                self._dropped.inc(len(items))
+        if not stored:
+            self.logger.error(f"{self.name} spool full, dropped {len(items)} items")
+        return stored
+
+    def _next_batch(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self.running or not self.queue.empty():
+            if self.spilling:
+                self._replay()
+                continue
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._flush(batch)
+            except PartialWriteError as e:
+                if self.metrics:
+                    self._written.inc(e.written)
+                self.logger.error(f"{self.name} bulk write: {str(e)}")
+                if self.spool is not None:
+                    with self.spill_lock:
+                        self._start_spilling(list(e.items))
+            except Exception as e:
+                self.logger.error(f"{self.name} bulk write of {len(batch)} failed: {str(e)}")
+                if self.spool is not None:
+                    with self.spill_lock:
+                        self._start_spilling(batch)
+
+    def _flush(self, batch):
+        written = self.flush_fn(batch)
+        if self.metrics:
+            self._written.inc(len(batch) if written is None else written)
+
+    def _replay(self):
+        with self.replay_lock:
+            self.spool.sync()
+            with self.spill_lock:
+                items, position = self.spool.read(self.batch_size)
+                if not items:
+                    # Decided under the lock so a concurrent submit cannot
+                    # strand an item in the spool after spilling ends
+                    self.spilling = False
+                    self.spool.commit(position)
+                    self.logger.info(f"{self.name} spool drained")
+                    return
+            try:
+                self._flush(items)
+            except Exception as e:
+                self.backoff = min(max(self.backoff * 2, 1.0), self.max_backoff)
+                self.logger.error(
+                    f"{self.name} spool replay failed, retrying in {self.backoff:.1f}s: {str(e)}")
+                time.sleep(self.backoff)
+                return
+            self.backoff = 0
+            self.spool.commit(position)
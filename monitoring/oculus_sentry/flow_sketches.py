@@ -0,0 +1,290 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Streaming Flow Sketches
+# Path: /monitoring/oculus_sentry/flow_sketches.py
+import heapq
+import math
+from collections import OrderedDict
+
+MASK64 = (1 << 64) - 1
+
+
+def _hash64(key):
+    # Python's string/tuple hash is SipHash-based and well mixed; it is
+    # salted per process, which is fine for sketches that never leave it
+    return hash(key) & MASK64
+
+
+class CountMinSketch:
+    """Fixed-size frequency estimates that never under-count"""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, key):
+        # Kirsch-Mitzenmacher: derive every row index from one 64-bit hash
+        h = _hash64(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, key, value=1):
+        """Add ``value`` for ``key`` and return the updated estimate"""
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += value
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class SpaceSaving:
+    """Top-k candidates in ``k`` counters (Metwally et al.).
+
+    A new key takes over the smallest counter and inherits its count as
+    the error bound. The minimum is found through a lazy heap: stale heap
+    entries are skipped on pop and the heap is rebuilt when it grows past
+    a few times ``k``.
+    """
+
+    def __init__(self, k=100):
+        self.k = k
+        self.counters = {}
+        self.heap = []
+
+    def add(self, key, value=1):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += value
+        elif len(self.counters) < self.k:
+            counter = self.counters[key] = [value, 0]
+        else:
+            count, victim = self._pop_min()
+            del self.counters[victim]
+            counter = self.counters[key] = [count + value, count]
+
+        heapq.heappush(self.heap, (counter[0], key))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(c[0], k) for k, c in self.counters.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                return count, key
+
+    def top(self, limit=None):
+        """``[(key, count, error)]`` by descending count"""
+        ranked = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count, error) for key, (count, error) in ranked[:limit or self.k]]
+
+
+class HyperLogLog:
+    """Cardinality estimate in ``2 ** precision`` one-byte registers"""
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+
+    def add_hash(self, h):
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def count(self):
+        m = self.m
+        estimate = self.alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        if estimate <= 2.5 * m:
+            zeros = self.registers.count(0)
+            if zeros:
+                # Linear counting is more accurate in the small range
+                return m * math.log(m / zeros)
+        return estimate
+
+
+class DistinctCounter:
+    """Exact set of hashes for small counts, promoted to HyperLogLog.
+
+    Most sources talk to a handful of peers, so only the ones that fan out
+    pay for a full register array.
+    """
+
+    __slots__ = ('hashes', 'hll')
+
+    def __init__(self):
+        self.hashes = set()
+        self.hll = None
+
+    def add(self, key, precision, sparse_limit):
+        """Add ``key``; returns False when the count cannot have changed"""
+        h = _hash64(key)
+        if self.hll is not None:
+            return self.hll.add_hash(h)
+        if h in self.hashes:
+            return False
+        self.hashes.add(h)
+        if len(self.hashes) > sparse_limit:
+            self.hll = HyperLogLog(precision)
+            for value in self.hashes:
+                self.hll.add_hash(value)
+            self.hashes = None
+        return True
+
+    def count(self):
+        return len(self.hashes) if self.hll is None else int(round(self.hll.count()))
+
+
+class FlowSketches:
+    """Top talkers and scan detection over tumbling flow windows.
+
+    Each ``window`` seconds of flow time gets fresh sketches, so memory is
+    fixed by ``top_k``, the Count-Min dimensions and ``max_sources``:
+
+    - source/destination pairs are ranked by bytes and by packets with
+      Space-Saving; reported counts are capped by the Count-Min estimate,
+      which tightens Space-Saving's over-count for evicted-and-returned keys
+    - distinct destinations per source are counted with HyperLogLog, for at
+      most ``max_sources`` sources (least recently seen are dropped)
+
+    ``observe`` returns alert dicts: a scan alert as soon as a source
+    crosses ``scan_threshold`` distinct destinations (once per window) and,
+    when a window closes, heavy-hitter alerts for pairs above
+    ``heavy_hitter_bytes``. Closed-window results are published to the
+    Prometheus gauges in ``metrics``.
+    """
+
+    def __init__(self, window=60, top_k=100, cms_width=2048, cms_depth=4,
+                 max_sources=50000, hll_precision=10, sparse_limit=64,
+                 scan_threshold=100, heavy_hitter_bytes=None, metrics=None):
+        self.window = window
+        self.top_k = top_k
+        self.cms_width = cms_width
+        self.cms_depth = cms_depth
+        self.max_sources = max_sources
+        self.hll_precision = hll_precision
+        self.sparse_limit = sparse_limit
+        self.scan_threshold = scan_threshold
+        self.heavy_hitter_bytes = heavy_hitter_bytes
+        self.metrics = metrics
+        self.window_start = None
+        self.last_report = None
+        self._reset()
+
+    def _reset(self):
+        self.bytes_cms = CountMinSketch(self.cms_width, self.cms_depth)
+        self.packets_cms = CountMinSketch(self.cms_width, self.cms_depth)
+        self.bytes_top = SpaceSaving(self.top_k)
+        self.packets_top = SpaceSaving(self.top_k)
+        self.destinations = OrderedDict()
+        self.scanners = set()
+
+    def observe(self, flow, now):
+        """Fold one flow into the current window; returns alerts"""
+        alerts = []
+        if self.window_start is None:
+            self.window_start = now
+        elif now - self.window_start >= self.window:
+            alerts.extend(self.rotate(now))
+
+        src, dst = flow.get('src_ip'), flow.get('dst_ip')
+        if src is None or dst is None:
+            return alerts
+        pair = (src, dst)
+        octets = flow.get('bytes', 0)
+        packets = flow.get('packets', 0)
+        self.bytes_cms.add(pair, octets)
+        self.packets_cms.add(pair, packets)
+        self.bytes_top.add(pair, octets)
+        self.packets_top.add(pair, packets)
+
+        counter = self.destinations.get(src)
+        if counter is None:
+            counter = self.destinations[src] = DistinctCounter()
+            if len(self.destinations) > self.max_sources:
+                self.destinations.popitem(last=False)
+        else:
+            self.destinations.move_to_end(src)
+        changed = counter.add(dst, self.hll_precision, self.sparse_limit)
+
+        # HyperLogLog counts cost a register scan, so only re-check on change
+        if changed and src not in self.scanners:
+            distinct = counter.count()
+            if distinct >= self.scan_threshold:
+                self.scanners.add(src)
+                alerts.append({
+                    'rule': 'network_scan',
+                    'severity': 'high',
+                    'src_ip': src,
+                    'distinct_destinations': distinct,
+                    'window_seconds': self.window
+                })
+        return alerts
+
+    def top_talkers(self, by='bytes', limit=None):
+        """``[{'src_ip', 'dst_ip', by, 'error'}]`` for the current window"""
+        top, cms = ((self.bytes_top, self.bytes_cms) if by == 'bytes'
+                    else (self.packets_top, self.packets_cms))
+        return [{
+            'src_ip': src,
+            'dst_ip': dst,
+            by: min(count, cms.estimate((src, dst))),
+            'error': error
+        } for (src, dst), count, error in top.top(limit)]
+
+    def top_sources_by_fanout(self, limit=20):
+        counts = [(src, counter.count()) for src, counter in self.destinations.items()]
+        counts.sort(key=lambda item: item[1], reverse=True)
+        return counts[:limit]
+
+    def rotate(self, now):
+        """Close the current window, publish it and start a new one"""
+        report = {
+            'window_start': self.window_start,
+            'window_end': now,
+            'bytes': self.top_talkers('bytes'),
+            'packets': self.top_talkers('packets'),
+            'fanout': self.top_sources_by_fanout()
+        }
+        alerts = []
+        if self.heavy_hitter_bytes:
+            for talker in report['bytes']:
+                if talker['bytes'] - talker['error'] >= self.heavy_hitter_bytes:
+                    alerts.append({
+                        'rule': 'heavy_hitter',
+                        'severity': 'medium',
+                        'src_ip': talker['src_ip'],
+                        'dst_ip': talker['dst_ip'],
+                        'bytes': talker['bytes'],
+                        'window_seconds': self.window
+                    })
+
+        self._publish(report)
+        self.last_report = report
+        self.window_start = now
+        self._reset()
+        return alerts
+
+    def _publish(self, report):
+        if not self.metrics:
+            return
+        # Labels change every window, so old series are dropped first
+        for name, field in (('top_talker_bytes', 'bytes'), ('top_talker_packets', 'packets')):
+            gauge = self.metrics[name]
+            gauge.clear()
+            for talker in report[field]:
+                gauge.labels(src_ip=talker['src_ip'], dst_ip=talker['dst_ip']).set(talker[field])
+        fanout = self.metrics['distinct_destinations']
+        fanout.clear()
+        for src, count in report['fanout']:
+            fanout.labels(src_ip=src).set(count)
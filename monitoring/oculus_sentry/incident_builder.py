@@ -0,0 +1,188 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Streaming Incident Builder
+# Path: /monitoring/oculus_sentry/incident_builder.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+
+# Index is the stored severity_rank; strings compare wrongly ("medium" > "high")
+SEVERITIES = ('info', 'low', 'medium', 'high', 'critical')
+SEVERITY_RANK = {name: rank for rank, name in enumerate(SEVERITIES)}
+MAX_ALERT_IDS = 1000
+
+
+def alert_entity(alert):
+    return alert.get('source_ip') or alert.get('src_ip')
+
+
+class IncidentBuilder:
+    """Group alerts into per-entity incidents as they are raised.
+
+    Each entity has a session that stays open while its alerts arrive less
+    than ``gap`` seconds apart, for at most ``max_duration`` seconds. A
+    session becomes an incident once it holds ``min_alerts`` alerts; after
+    that every new alert is merged into the same incident document.
+
+    ``add`` only updates memory. ``flush`` turns everything gathered since
+    the last flush into one update per incident, written with a single
+    ``bulk_write``, and marks the alerts correlated. The first write for a
+    session merges into a recent open incident for the entity if one exists
+    (e.g. from before a restart) instead of opening a duplicate. Updates are
+    aggregation pipelines, so counts, alert ids, rules and the highest
+    severity are combined inside Mongo. If a flush fails its alerts stay
+    uncorrelated and are picked up again by the startup sweep.
+    """
+
+    def __init__(self, db, gap=600, max_duration=86400, min_alerts=3,
+                 max_sessions=100000, logger=None):
+        self.incidents = db.incidents
+        self.alerts = db.alerts
+        self.gap = gap
+        self.max_duration = max_duration
+        self.min_alerts = min_alerts
+        self.max_sessions = max_sessions
+        self.logger = logger or logging.getLogger('IncidentBuilder')
+        self.sessions = OrderedDict()
+        self.correlated = []
+        self.detached = []
+        self.lock = threading.Lock()
+
+    def add(self, alert, now=None):
+        """Fold a stored alert (with ``_id`` and ``created_at``) into its session"""
+        entity = alert_entity(alert)
+        now = now or time.time()
+        rank = SEVERITY_RANK.get(alert.get('severity'), 0)
+
+        with self.lock:
+            if entity is None:
+                self.correlated.append(alert['_id'])
+                return
+            session = self.sessions.get(entity)
+            if session is not None and (now - session['seen'] > self.gap
+                                        or now - session['started'] > self.max_duration):
+                self._close(entity)
+                session = None
+            if session is None:
+                session = self.sessions[entity] = self._new_session(now)
+                if len(self.sessions) > self.max_sessions:
+                    self._close(next(iter(self.sessions)))
+            else:
+                self.sessions.move_to_end(entity)
+
+            session['seen'] = now
+            session['count'] += 1
+            pending = session['pending']
+            pending['ids'].append(alert['_id'])
+            pending['rules'].add(alert.get('rule'))
+            pending['rank'] = max(pending['rank'], rank)
+            pending['first'] = pending['first'] or alert.get('created_at')
+            pending['last'] = alert.get('created_at')
+
+    def _new_session(self, now):
+        return {
+            'started': now,
+            'seen': now,
+            'count': 0,
+            'incident_id': None,
+            'pending': self._empty_pending()
+        }
+
+    @staticmethod
+    def _empty_pending():
+        return {'ids': [], 'rules': set(), 'rank': 0, 'first': None, 'last': None}
+
+    def _close(self, entity):
+        session = self.sessions.pop(entity)
+        if session['count'] < self.min_alerts:
+            # Never became an incident: just mark its alerts handled
+            self.correlated.extend(session['pending']['ids'])
+        # A closed incident with unflushed alerts is written by the next flush
+        elif session['pending']['ids']:
+            self.detached.append((entity, session))
+
+    def _take(self, now):
+        """Expire idle sessions and detach the pending deltas to write"""
+        with self.lock:
+            cutoff = now - self.gap
+            while self.sessions:
+                entity, session = next(iter(self.sessions.items()))
+                if session['seen'] > cutoff:
+                    break
+                self._close(entity)
+
+            work, self.detached = self.detached, []
+            for entity, session in self.sessions.items():
+                if session['count'] >= self.min_alerts and session['pending']['ids']:
+                    work.append((entity, session))
+            deltas = []
+            for entity, session in work:
+                deltas.append((entity, session, session['pending']))
+                session['pending'] = self._empty_pending()
+            correlated, self.correlated = self.correlated, []
+        return deltas, correlated
+
+    def flush(self, now=None):
+        """Write pending incident updates; returns the number of incidents touched"""
+        deltas, correlated = self._take(now or time.time())
+        operations = []
+        for entity, session, pending in deltas:
+            pipeline = self._pipeline(pending)
+            if session['incident_id'] is None:
+                session['incident_id'] = self._open(entity, pending, pipeline)
+            else:
+                operations.append(UpdateOne({'_id': session['incident_id']}, pipeline))
+            correlated.extend(pending['ids'])
+
+        if operations:
+            self.incidents.bulk_write(operations, ordered=False)
+        if correlated:
+            self.alerts.update_many(
+                {'_id': {'$in': correlated}},
+                {'$set': {'correlated': True}}
+            )
+        return len(deltas)
+
+    def _open(self, entity, pending, pipeline):
+        # Join an open incident for the entity that is still inside its
+        # session window; otherwise the upsert creates a new one
+        first = pending['first'] or datetime.utcnow()
+        incident = self.incidents.find_one_and_update(
+            {
+                'source_ip': entity,
+                'status': 'open',
+                'last_seen': {'$gte': first - timedelta(seconds=self.gap)}
+            },
+            pipeline,
+            upsert=True,
+            projection={'_id': True},
+            return_document=ReturnDocument.AFTER
+        )
+        return incident['_id']
+
+    def _pipeline(self, pending):
+        now = datetime.utcnow()
+        first = pending['first'] or now
+        last = pending['last'] or now
+        return [
+            {'$set': {
+                'timestamp': {'$ifNull': ['$timestamp', now.isoformat()]},
+                'created_at': {'$ifNull': ['$created_at', now]},
+                'first_seen': {'$ifNull': ['$first_seen', first]},
+                'last_seen': {'$max': ['$last_seen', last]},
+                'alert_count': {'$add': [{'$ifNull': ['$alert_count', 0]}, len(pending['ids'])]},
+                'alerts': {'$slice': [
+                    {'$concatArrays': [{'$ifNull': ['$alerts', []]}, pending['ids']]},
+                    MAX_ALERT_IDS
+                ]},
+                'rules': {'$setUnion': [{'$ifNull': ['$rules', []]}, sorted(r for r in pending['rules'] if r)]},
+                'severity_rank': {'$max': [{'$ifNull': ['$severity_rank', 0]}, pending['rank']]}
+            }},
+            {'$set': {'severity': {'$arrayElemAt': [list(SEVERITIES), '$severity_rank']}}}
+        ]
+
+    def flush_all(self):
+        """Close every session and write what is left, e.g. on shutdown"""
+        return self.flush(time.time() + self.gap + 1)
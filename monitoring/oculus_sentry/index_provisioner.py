@@ -0,0 +1,127 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Mongo Index Provisioning
+# Path: /monitoring/oculus_sentry/index_provisioner.py
+import json
+import logging
+import sys
+
+import pymongo
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+INDEX_OPTIONS_CONFLICT = 85
+INDEX_KEY_SPECS_CONFLICT = 86
+
+# Only indexes backed by a query; each comment names its call site.
+# events has just its TTL index: it takes the highest insert volume and
+# is only read back by _id (acks) or through the change stream.
+INDEX_SPECS = {
+    'events': [],
+    'alerts': [
+        # OculusSentry.recover_uncorrelated_alerts: find({'correlated': False})
+        # sorted by created_at. Alerts are inserted with correlated=False
+        # because partial indexes cannot filter on $exists: false. The
+        # leading key keeps it distinct from ttl_created_at's {created_at: 1}.
+        ('uncorrelated', [('correlated', ASCENDING), ('created_at', ASCENDING)],
+         {'partialFilterExpression': {'correlated': False}})
+    ],
+    'incidents': [
+        # IncidentBuilder._open: open incident for the entity by last_seen
+        ('source_status_seen', [('source_ip', ASCENDING), ('status', ASCENDING), ('last_seen', DESCENDING)], {})
+    ]
+}
+
+DEFAULT_RETENTION_DAYS = {
+    'events': 30,
+    'alerts': 180,
+    'incidents': 365
+}
+
+
+def _ensure_index(collection, name, keys, options, logger):
+    """Create an index; one of ours left with older keys is rebuilt"""
+    try:
+        collection.create_index(keys, name=name, **options)
+    except OperationFailure as e:
+        if e.code != INDEX_KEY_SPECS_CONFLICT:
+            raise
+        collection.drop_index(name)
+        collection.create_index(keys, name=name, **options)
+        logger.info(f"Rebuilt index {collection.name}.{name} with keys {keys}")
+
+
+def _ensure_ttl(collection, days, logger):
+    """TTL on ``created_at`` (a BSON date); retunes an existing index in place"""
+    seconds = int(days * 86400)
+    try:
+        collection.create_index('created_at', name='ttl_created_at', expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        collection.database.command(
+            'collMod', collection.name,
+            index={'name': 'ttl_created_at', 'expireAfterSeconds': seconds}
+        )
+        logger.info(f"Updated {collection.name} retention to {days} days")
+
+
+def _building(db):
+    """Names of index builds currently in progress, per collection"""
+    try:
+        ops = db.client.admin.command(
+            'currentOp', {'command.createIndexes': {'$exists': True}}
+        ).get('inprog', [])
+    except OperationFailure:
+        return {}
+    building = {}
+    for op in ops:
+        command = op.get('command', {})
+        names = [index.get('name') for index in command.get('indexes', [])]
+        building.setdefault(command.get('createIndexes'), set()).update(names)
+    return building
+
+
+def provision_indexes(db, retention_days=None, logger=None):
+    """Create query and TTL indexes; returns ``{collection: {index: status}}``"""
+    logger = logger or logging.getLogger('IndexProvisioner')
+    retention = dict(DEFAULT_RETENTION_DAYS, **(retention_days or {}))
+    report = {}
+
+    for name, specs in INDEX_SPECS.items():
+        collection = db[name]
+        status = report.setdefault(name, {})
+        for index_name, keys, options in specs:
+            try:
+                _ensure_index(collection, index_name, keys, options, logger)
+            except OperationFailure as e:
+                status[index_name] = f"error: {e.details.get('errmsg', str(e)) if e.details else str(e)}"
+        try:
+            _ensure_ttl(collection, retention[name], logger)
+        except OperationFailure as e:
+            status['ttl_created_at'] = f"error: {str(e)}"
+
+    building = _building(db)
+    for name, status in report.items():
+        existing = db[name].index_information()
+        for index_name in [spec[0] for spec in INDEX_SPECS[name]] + ['ttl_created_at']:
+            if index_name in status:
+                continue
+            if index_name in building.get(name, ()):
+                status[index_name] = 'building'
+            elif index_name in existing:
+                status[index_name] = 'ready'
+            else:
+                status[index_name] = 'missing'
+
+    for name, status in report.items():
+        for index_name, state in status.items():
+            log = logger.info if state == 'ready' else logger.warning
+            log(f"Index {name}.{index_name}: {state}")
+    return report
+
+
+if __name__ == '__main__':
+    # python index_provisioner.py mongodb://localhost:27017 aegis_shield
+    uri = sys.argv[1] if len(sys.argv) > 1 else 'mongodb://localhost:27017'
+    database = sys.argv[2] if len(sys.argv) > 2 else 'aegis_shield'
+    client = pymongo.MongoClient(uri)
+    print(json.dumps(provision_indexes(client[database]), indent=2))
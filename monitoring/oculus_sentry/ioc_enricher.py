@@ -0,0 +1,158 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Threat Intel Enrichment
+# Path: /monitoring/oculus_sentry/ioc_enricher.py
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+
+from rule_repository import field_getter
+
+IOC_DB = 'monitoring/threat_horizon/ioc_database/threats.db'
+
+OBSERVABLE_FIELDS = {
+    'ip': ('source.ip', 'destination.ip', 'client.ip', 'server.ip'),
+    'domain': ('dns.question.name', 'url.domain', 'destination.domain'),
+    'hash': ('file.hash.md5', 'file.hash.sha1', 'file.hash.sha256', 'process.hash.sha256'),
+}
+
+SQLITE_MAX_PARAMS = 900
+
+
+class IOCEnricher:
+    """Batch lookup of event observables against the Threat Horizon IOC store.
+
+    Results, including misses, are held in a bounded LRU cache so the hot
+    path only touches SQLite for values not seen recently, and then with one
+    ``IN (...)`` query per polled batch. Misses expire sooner than hits so
+    newly published indicators are picked up quickly, and the whole cache is
+    dropped when threats.db is rewritten by the feed processor.
+    """
+
+    def __init__(self, db_path=IOC_DB, max_entries=200000, ttl=900,
+                 negative_ttl=120, refresh_interval=60, logger=None):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_interval = refresh_interval
+        self.logger = logger or logging.getLogger('IOCEnricher')
+        self.cache = OrderedDict()
+        self.conn = None
+        self._db_mtime = None
+        self._next_refresh = 0
+        self.getters = [
+            (ioc_type, field_getter(field))
+            for ioc_type, fields in OBSERVABLE_FIELDS.items()
+            for field in fields
+        ]
+
+    def _connect(self):
+        if self.conn is None and os.path.exists(self.db_path):
+            self.conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+        return self.conn
+
+    def _refresh(self, now):
+        if now < self._next_refresh:
+            return
+        self._next_refresh = now + self.refresh_interval
+        try:
+            mtime = os.stat(self.db_path).st_mtime
+        except OSError:
+            return
+        if self._db_mtime is not None and mtime != self._db_mtime:
+            self.logger.info("IOC database changed, clearing enrichment cache")
+            self.cache.clear()
+        self._db_mtime = mtime
+
+    def _observables(self, event):
+        found = []
+        for ioc_type, get in self.getters:
+            value = get(event)
+            if value:
+                found.append((ioc_type, str(value)))
+        return found
+
+    def _lookup(self, values):
+        conn = self._connect()
+        if conn is None:
+            return {}
+        matches = {}
+        values = list(values)
+        cursor = conn.cursor()
+        for i in range(0, len(values), SQLITE_MAX_PARAMS):
+            chunk = values[i:i + SQLITE_MAX_PARAMS]
+            cursor.execute(
+                'SELECT type, value, source, severity, last_seen FROM iocs '
+                f'WHERE is_active = 1 AND value IN ({",".join("?" * len(chunk))})',
+                chunk
+            )
+            for row in cursor.fetchall():
+                matches[row[1]] = {
+                    'type': row[0],
+                    'value': row[1],
+                    'source': row[2],
+                    'severity': row[3],
+                    'last_seen': row[4]
+                }
+        return matches
+
+    def _get(self, value, now):
+        entry = self.cache.get(value)
+        if entry is None:
+            return False, None
+        expires, match = entry
+        if expires <= now:
+            del self.cache[value]
+            return False, None
+        self.cache.move_to_end(value)
+        return True, match
+
+    def _put(self, value, match, now):
+        ttl = self.ttl if match else self.negative_ttl
+        self.cache[value] = (now + ttl, match)
+        self.cache.move_to_end(value)
+        if len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    def enrich_batch(self, events, now):
+        """Attach ``ioc_matches`` to every event with a known indicator"""
+        self._refresh(now)
+        per_event = []
+        resolved = {}
+        misses = set()
+        for event in events:
+            observables = self._observables(event)
+            per_event.append(observables)
+            for _, value in observables:
+                if value in resolved or value in misses:
+                    continue
+                hit, match = self._get(value, now)
+                if hit:
+                    resolved[value] = match
+                else:
+                    misses.add(value)
+
+        if misses:
+            try:
+                found = self._lookup(misses)
+                for value in misses:
+                    resolved[value] = found.get(value)
+                    self._put(value, resolved[value], now)
+            except sqlite3.Error as e:
+                # Leave misses uncached so the next batch retries them
+                self.logger.error(f"IOC lookup error: {str(e)}")
+
+        matched = 0
+        for event, observables in zip(events, per_event):
+            hits = []
+            for _, value in observables:
+                match = resolved.get(value)
+                if match:
+                    hits.append(match)
+            if hits:
+                event['ioc_matches'] = hits
+                matched += 1
+        return matched
+
+    def __len__(self):
+        return len(self.cache)
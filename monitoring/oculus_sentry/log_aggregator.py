@@ -1,26 +1,80 @@
+import functools
 import logging
 import json
+import os
+import queue
+import random
 import time
 from datetime import datetime
 import pandas as pd
 from elasticsearch import Elasticsearch
 import pymongo
+from bson import ObjectId
 import socket
-import syslog
 import threading
-from prometheus_client import start_http_server, Counter, Gauge
+from prometheus_client import start_http_server, Counter, Gauge, Histogram
+
+from bulk_writer import BulkWriter
+from flow_sketches import FlowSketches
+from incident_builder import IncidentBuilder
+from index_provisioner import provision_indexes
+from netflow_collector import NetflowCollector
+from pipeline_metrics import STAGE_BUCKETS, StageTimer, ThreatLevel
+from rule_repository import event_time
+from sinks import DEFAULT_ROUTES, DEFAULT_SINKS, WRITER_OPTIONS, Router, build_sinks
+from sliding_window import SlidingWindow
+from spool import Spool
+from syslog_parser import parse_syslog
+from syslog_receiver import SyslogReceiver
 
 class OculusSentry:
-    def __init__(self, config_file='sentry_config.json'):
+    def __init__(self, config_file='sentry_config.json', metrics_port=None, ingest_only=False,
+                 mongo_client=None):
         with open(config_file) as f:
             self.config = json.load(f)
         
+        self.config_file = config_file
+        self.ingest_only = ingest_only
+        self.metrics_port = metrics_port or self.config.get('metrics_port', 9090)
         self.logger = self.setup_logger()
         self.es = Elasticsearch(self.config['elasticsearch_hosts'])
-        self.mongo = pymongo.MongoClient(self.config['mongo_uri'])
+        self.mongo = mongo_client or pymongo.MongoClient(self.config['mongo_uri'])
         self.db = self.mongo[self.config['mongo_db']]
         self.alerts = self.db.alerts
+        if not ingest_only:
+            self.index_report = provision_indexes(
+                self.db, self.config.get('retention_days'), self.logger)
         self.metrics = self.setup_metrics()
+        self.threat = ThreatLevel(half_life=self.config.get('threat_half_life', 300))
+        self.metrics['threat_level'].set_function(self.threat.value)
+        sample_every = self.config.get('metrics_sample_every', 100)
+        self.stage_timers = {
+            source: StageTimer(self.metrics['stage_time'], source,
+                               ('receive', 'parse', 'enqueue'), sample_every)
+            for source in ('syslog', 'netflow', 'windows_event')
+        }
+        self.writers = self.setup_writers()
+        self.windows = self.setup_correlation_windows()
+        self.flow_sketches = FlowSketches(
+            window=self.config.get('flow_window', 60),
+            top_k=self.config.get('flow_top_k', 20),
+            max_sources=self.config.get('flow_max_sources', 50000),
+            scan_threshold=self.config.get('scan_threshold', 100),
+            heavy_hitter_bytes=self.config.get('heavy_hitter_bytes'),
+            metrics=self.metrics
+        )
+        self.incident_builder = IncidentBuilder(
+            self.db,
+            gap=self.config.get('incident_gap', 600),
+            max_duration=self.config.get('incident_max_duration', 86400),
+            min_alerts=self.config.get('incident_min_alerts', 3),
+            logger=self.logger
+        )
+        self.correlation_source = self.config.get('correlation_source', 'queue')
+        self.correlation_queue = queue.Queue(
+            maxsize=self.config.get('correlation_queue_size', 100000))
+        self.metrics['queue_depth'].labels(sink='correlation').set_function(
+            self.correlation_queue.qsize)
         self.running = True
         
     def setup_logger(self):
@@ -41,21 +95,161 @@ class OculusSentry:
                 'sentry_alerts_triggered_total',
                 'Total security alerts triggered'
             ),
-            'processing_time': Gauge(
-                'sentry_event_processing_seconds',
-                'Time taken to process events'
+            'listener_events': Counter(
+                'sentry_listener_events_total',
+                'Events received per listener',
+                ['listener']
+            ),
+            'stage_time': Histogram(
+                'sentry_pipeline_stage_seconds',
+                'Sampled time per stage: receive (whole datagram or batch), parse and '
+                'enqueue (per event) by source type; store (per bulk write) by sink',
+                ['stage', 'source'],
+                buckets=STAGE_BUCKETS
             ),
             'threat_level': Gauge(
                 'sentry_threat_level',
                 'Current threat level (0-10)'
+            ),
+            'queue_depth': Gauge(
+                'sentry_storage_queue_depth',
+                'Events waiting for a storage writer',
+                ['sink']
+            ),
+            'events_dropped': Counter(
+                'sentry_storage_dropped_total',
+                'Events dropped because a storage queue was full',
+                ['sink']
+            ),
+            'events_written': Counter(
+                'sentry_storage_written_total',
+                'Events handed to a store in bulk',
+                ['sink']
+            ),
+            'events_sampled_out': Counter(
+                'sentry_events_sampled_out_total',
+                'Events not stored because their route samples them',
+                ['type']
+            ),
+            'events_spooled': Counter(
+                'sentry_storage_spooled_total',
+                'Events written to the disk spool instead of a store',
+                ['sink']
+            ),
+            'spool_bytes': Gauge(
+                'sentry_spool_bytes',
+                'Bytes waiting in the disk spool',
+                ['sink']
+            ),
+            'spool_age': Gauge(
+                'sentry_spool_age_seconds',
+                'Age of the oldest event waiting in the disk spool',
+                ['sink']
+            ),
+            'top_talker_bytes': Gauge(
+                'sentry_top_talker_bytes',
+                'Bytes per top source/destination pair in the last flow window',
+                ['src_ip', 'dst_ip']
+            ),
+            'top_talker_packets': Gauge(
+                'sentry_top_talker_packets',
+                'Packets per top source/destination pair in the last flow window',
+                ['src_ip', 'dst_ip']
+            ),
+            'distinct_destinations': Gauge(
+                'sentry_flow_distinct_destinations',
+                'Estimated distinct destinations per source in the last flow window',
+                ['src_ip']
             )
         }
         
         # Start Prometheus metrics server
-        start_http_server(9090)
+        start_http_server(self.metrics_port)
         return metrics
     
+    def setup_writers(self):
+        """One BulkWriter per configured sink, plus the router that feeds them"""
+        self.sinks = build_sinks(
+            self.config.get('sinks', DEFAULT_SINKS),
+            es=self.es, db=self.db, metrics=self.metrics, logger=self.logger
+        )
+        self.router = Router(self.config.get('routes', DEFAULT_ROUTES), self.sinks, self.metrics)
+        defaults = {
+            'queue_size': self.config.get('writer_queue_size', 50000),
+            'batch_size': self.config.get('writer_batch_size', 1000),
+            'flush_interval': self.config.get('writer_flush_interval', 1.0)
+        }
+        writers = {}
+        for name, sink in self.sinks.items():
+            options = dict(defaults, **{k: sink.options[k] for k in WRITER_OPTIONS if k in sink.options})
+            writers[name] = BulkWriter(
+                name, sink.write, spool=self.setup_spool(name),
+                metrics=self.metrics, logger=self.logger, **options
+            )
+        return writers
+    
+    def setup_spool(self, sink):
+        """Disk overflow for a writer; disabled when ``spool_dir`` is unset"""
+        spool_dir = self.config.get('spool_dir')
+        if not spool_dir:
+            return None
+        # metrics_port is unique per process (syslog workers use base + 1 + index),
+        # so each process owns its spool and finds it again after a restart
+        return Spool(
+            os.path.join(spool_dir, f"{sink}-{self.metrics_port}"),
+            segment_bytes=self.config.get('spool_segment_mb', 64) * 1024 * 1024,
+            max_bytes=self.config.get('spool_max_mb', 1024) * 1024 * 1024,
+            logger=self.logger
+        )
+    
+    def setup_correlation_windows(self):
+        windows = {
+            'failed_logins': SlidingWindow(
+                self.config.get('failed_login_window', 300),
+                max_keys=self.config.get('correlation_max_keys', 100000)
+            )
+        }
+        self.checkpoint_file = self.config.get('correlation_checkpoint')
+        self.checkpoint_interval = self.config.get('checkpoint_interval', 60)
+        self.last_checkpoint = time.time()
+        
+        if self.checkpoint_file and os.path.exists(self.checkpoint_file):
+            try:
+                with open(self.checkpoint_file) as f:
+                    saved = json.load(f)
+                now = time.time()
+                for name, items in saved.get('windows', {}).items():
+                    if name in windows:
+                        windows[name].restore(items, now)
+                self.logger.info(f"Restored correlation windows from {self.checkpoint_file}")
+            except (OSError, ValueError) as e:
+                self.logger.error(f"Checkpoint restore error: {str(e)}")
+        return windows
+    
+    def checkpoint_windows(self, force=False):
+        """Persist window counters so counts survive a restart"""
+        if not self.checkpoint_file:
+            return
+        now = time.time()
+        if not force and now - self.last_checkpoint < self.checkpoint_interval:
+            return
+        self.last_checkpoint = now
+        
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({
+                    'saved_at': now,
+                    'windows': {name: w.snapshot() for name, w in self.windows.items()}
+                }, f)
+            os.replace(tmp_file, self.checkpoint_file)
+        except OSError as e:
+            self.logger.error(f"Checkpoint write error: {str(e)}")
+    
     def start_monitoring(self):
+        for writer in self.writers.values():
+            writer.start()
+        
         # Start all monitoring threads
         threads = [
             threading.Thread(target=self.syslog_listener),
@@ -63,6 +257,8 @@ class OculusSentry:
             threading.Thread(target=self.netflow_analyzer),
             threading.Thread(target=self.alert_correlator)
         ]
+        if self.correlation_source == 'change_stream':
+            threads.append(threading.Thread(target=self.change_stream_listener))
         
         for thread in threads:
             thread.daemon = True
@@ -74,37 +270,105 @@ class OculusSentry:
         while self.running:
             try:
                 self.process_queued_events()
-                time.sleep(1)
             except KeyboardInterrupt:
                 self.running = False
             except Exception as e:
                 self.logger.error(f"Processing error: {str(e)}")
                 time.sleep(5)
+        
+        self.checkpoint_windows(force=True)
+        try:
+            self.incident_builder.flush_all()
+        except Exception as e:
+            self.logger.error(f"Alert correlation error: {str(e)}")
+        for writer in self.writers.values():
+            writer.stop()
+        for sink in self.sinks.values():
+            sink.close()
     
     def syslog_listener(self):
+        if self.config.get('syslog_receiver') == 'asyncio':
+            self.syslog_receiver()
+            return
+        
+        port = self.config.get('syslog_port', 514)
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(('0.0.0.0', 514))
+        sock.bind(('0.0.0.0', port))
         
-        self.logger.info("Syslog listener started on UDP 514")
+        self.logger.info(f"Syslog listener started on UDP {port}")
         
         while self.running:
             try:
                 data, addr = sock.recvfrom(8192)
-                message = data.decode('utf-8').strip()
-                
-                event = {
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'source_ip': addr[0],
-                    'facility': syslog.LOG_USER,
-                    'message': message,
-                    'type': 'syslog'
-                }
-                
-                self.store_event(event)
-                self.metrics['events_processed'].inc()
+                self.handle_syslog_batch([(data, addr)])
             except Exception as e:
                 self.logger.error(f"Syslog error: {str(e)}")
     
+    def syslog_receiver(self):
+        """asyncio/SO_REUSEPORT intake, optionally across worker processes.
+
+        With ``syslog_workers`` > 1 every worker process builds its own
+        ingest-only OculusSentry (writers, metrics on ``metrics_port`` + 1 +
+        worker index) from the same config file, so nothing is funnelled back
+        through this process.
+        """
+        workers = self.config.get('syslog_workers', 1)
+        if workers > 1:
+            factory = functools.partial(build_syslog_handler, self.config_file, self.metrics_port)
+        else:
+            factory = lambda index: self.handle_syslog_batch
+        
+        receiver = SyslogReceiver(
+            factory,
+            udp_port=self.config.get('syslog_port', 514),
+            tcp_port=self.config.get('syslog_tcp_port'),
+            workers=workers,
+            sockets_per_worker=self.config.get('syslog_sockets_per_worker', 2),
+            rcvbuf=self.config.get('syslog_rcvbuf', 32 * 1024 * 1024),
+            logger=self.logger
+        )
+        receiver.serve_forever()
+    
+    def build_syslog_event(self, data, addr, received):
+        """Typed syslog event; ``timestamp`` stays the receive time"""
+        event = parse_syslog(data, received)
+        event['timestamp'] = received.isoformat()
+        event['source_ip'] = addr[0]
+        event['type'] = 'syslog'
+        return event
+    
+    def handle_syslog_batch(self, batch):
+        received = datetime.utcnow()
+        self.ingest('syslog', batch, lambda item: self.build_syslog_event(item[0], item[1], received))
+    
+    def ingest(self, source, items, build=None):
+        """Store a received datagram or batch; ``build`` turns a raw item into an event.
+
+        Only batches picked by the source's StageTimer read the clock; the
+        rest go straight through.
+        """
+        timer = self.stage_timers[source]
+        if not timer.should_sample():
+            for item in items:
+                self.store_event(build(item) if build else item)
+        else:
+            start = time.perf_counter()
+            parse = enqueue = 0.0
+            for item in items:
+                t0 = time.perf_counter()
+                event = build(item) if build else item
+                t1 = time.perf_counter()
+                self.store_event(event)
+                parse += t1 - t0
+                enqueue += time.perf_counter() - t1
+            if items:
+                if build:
+                    timer.observe('parse', parse / len(items))
+                timer.observe('enqueue', enqueue / len(items))
+                timer.observe('receive', time.perf_counter() - start)
+        self.metrics['listener_events'].labels(listener=source).inc(len(items))
+        self.metrics['events_processed'].inc(len(items))
+    
     def windows_event_monitor(self):
         # Simulated Windows Event Log monitoring
         while self.running:
@@ -118,14 +382,26 @@ class OculusSentry:
                     'type': 'windows_event'
                 }
                 
-                self.store_event(event)
-                self.metrics['events_processed'].inc()
+                self.ingest('windows_event', [event])
                 time.sleep(random.uniform(0.1, 1.0))
             except Exception as e:
                 self.logger.error(f"Windows event error: {str(e)}")
                 time.sleep(5)
     
     def netflow_analyzer(self):
+        if not self.config.get('netflow_simulate'):
+            collector = NetflowCollector(
+                self.handle_flows,
+                port=self.config.get('netflow_port', 2055),
+                rcvbuf=self.config.get('netflow_rcvbuf', 16 * 1024 * 1024),
+                logger=self.logger,
+                # Separate sampler so decode timing does not skew ingest sampling
+                timer=StageTimer(self.metrics['stage_time'], 'netflow', ('parse',),
+                                 self.config.get('metrics_sample_every', 100))
+            )
+            collector.serve_forever()
+            return
+        
         # Simulated NetFlow analysis
         while self.running:
             try:
@@ -138,76 +414,109 @@ class OculusSentry:
                     'type': 'netflow'
                 }
                 
-                self.store_event(flow)
-                self.metrics['events_processed'].inc()
+                self.ingest('netflow', [flow])
                 time.sleep(0.1)
             except Exception as e:
                 self.logger.error(f"Netflow error: {str(e)}")
                 time.sleep(5)
     
+    def handle_flows(self, flows):
+        self.ingest('netflow', flows)
+    
     def store_event(self, event):
-        """Store event in both Elasticsearch and MongoDB"""
-        start_time = time.time()
+        """Queue event for its routed sinks and in-process correlation"""
+        # The id is assigned here so correlation can acknowledge the event
+        # before the Mongo writer has inserted it
+        event['_id'] = ObjectId()
+        # BSON date for the TTL index; the ISO 'timestamp' string is kept as is
+        event['created_at'] = datetime.utcnow()
+        sinks, ack_sink = self.router.route(event)
+        for name in sinks:
+            self.writers[name].submit(dict(event))
         
-        try:
-            # Index in Elasticsearch
-            self.es.index(
-                index='security-events',
-                body=event
-            )
-            
-            # Store in MongoDB
-            self.db.events.insert_one(event)
-            
-            # Update metrics
-            self.metrics['processing_time'].set(time.time() - start_time)
-        except Exception as e:
-            self.logger.error(f"Storage error: {str(e)}")
+        if self.correlation_source == 'queue' and not self.ingest_only:
+            # Set after the copies above, so it is never stored
+            event['_ack_sink'] = ack_sink
+            try:
+                self.correlation_queue.put_nowait(event)
+            except queue.Full:
+                self.metrics['events_dropped'].labels(sink='correlation').inc()
+    
+    def acknowledge_events(self, ids):
+        self.db.events.update_many(
+            {'_id': {'$in': ids}},
+            {'$set': {'processed': True}}
+        )
     
     def process_queued_events(self):
-        """Process events and trigger alerts"""
+        """Correlate events pushed by ingest (or the change stream) and ack in bulk"""
         try:
-            # Get recent events from MongoDB
-            query = {
-                'processed': {'$exists': False},
-                'timestamp': {
-                    '$gte': datetime.utcnow() - timedelta(minutes=5)
-                }
-            }
-            
-            events = list(self.db.events.find(query).limit(1000))
+            batch = self.next_correlation_batch()
             
-            for event in events:
+            for event in batch:
                 # Apply correlation rules
                 alerts = self.apply_correlation_rules(event)
                 
                 if alerts:
                     self.metrics['alerts_triggered'].inc(len(alerts))
-                    self.metrics['threat_level'].set(
-                        min(10, self.metrics['threat_level']._value.get() + 0.1 * len(alerts))
-                    )
-                
-                # Mark as processed
-                self.db.events.update_one(
-                    {'_id': event['_id']},
-                    {'$set': {'processed': True}}
-                )
+                    self.threat.add(len(alerts))
+            
+            if batch:
+                # Mark the whole batch processed with one update per Mongo sink
+                if self.correlation_source == 'change_stream':
+                    self.acknowledge_events([event['_id'] for event in batch])
+                else:
+                    acks = {}
+                    for event in batch:
+                        if event.get('_ack_sink'):
+                            acks.setdefault(event['_ack_sink'], []).append(event['_id'])
+                    for name, ids in acks.items():
+                        self.writers[name].submit({'_ack': ids})
+            
+            self.checkpoint_windows()
         except Exception as e:
             self.logger.error(f"Processing error: {str(e)}")
     
+    def next_correlation_batch(self, max_events=1000, timeout=1.0):
+        """Block briefly for the first event, then take what is already queued"""
+        try:
+            batch = [self.correlation_queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < max_events:
+            try:
+                batch.append(self.correlation_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def change_stream_listener(self):
+        """Feed inserted events to correlation from a Mongo change stream.
+
+        Needs a replica set; picks up events from every ingest process,
+        including syslog worker processes, rather than just this one.
+        """
+        pipeline = [{'$match': {'operationType': 'insert'}}]
+        while self.running:
+            try:
+                with self.db.events.watch(pipeline) as stream:
+                    self.logger.info("Correlating from events change stream")
+                    for change in stream:
+                        self.correlation_queue.put(change['fullDocument'])
+                        if not self.running:
+                            break
+            except Exception as e:
+                self.logger.error(f"Change stream error: {str(e)}")
+                time.sleep(5)
+    
     def apply_correlation_rules(self, event):
         """Apply security correlation rules to events"""
         alerts = []
         
         # Rule 1: Multiple failed logins
         if event.get('type') == 'windows_event' and event.get('event_id') == 4625:
-            count = self.db.events.count_documents({
-                'source_ip': event.get('source_ip'),
-                'event_id': 4625,
-                'timestamp': {
-                    '$gte': datetime.utcnow() - timedelta(minutes=5)
-                }
-            })
+            count = self.windows['failed_logins'].add(
+                event.get('source_ip'), event_time(event, time.time()))
             
             if count > 5:
                 alerts.append({
@@ -217,68 +526,69 @@ class OculusSentry:
                     'count': count
                 })
         
-        # Rule 2: Unusual data transfer
-        elif event.get('type') == 'netflow' and event.get('bytes', 0) > 500000:
-            alerts.append({
-                'rule': 'large_data_transfer',
-                'severity': 'medium',
-                'src_ip': event.get('src_ip'),
-                'dst_ip': event.get('dst_ip'),
-                'bytes': event.get('bytes')
-            })
+        elif event.get('type') == 'netflow':
+            # Rule 2: Top talkers and scanning sources over the flow window
+            alerts.extend(self.flow_sketches.observe(event, event_time(event, time.time())))
+            
+            # Rule 3: Unusual data transfer
+            if event.get('bytes', 0) > 500000:
+                alerts.append({
+                    'rule': 'large_data_transfer',
+                    'severity': 'medium',
+                    'src_ip': event.get('src_ip'),
+                    'dst_ip': event.get('dst_ip'),
+                    'bytes': event.get('bytes')
+                })
         
-        # Store alerts if any
+        # Store alerts if any and hand them straight to the incident builder
         if alerts:
-            self.alerts.insert_many([{
+            now = datetime.utcnow()
+            documents = [{
                 **alert,
-                'timestamp': datetime.utcnow().isoformat(),
-                'event_id': str(event.get('_id'))
-            } for alert in alerts])
+                'timestamp': now.isoformat(),
+                'created_at': now,
+                'event_id': str(event.get('_id')),
+                # Equality (not absence) so the partial 'uncorrelated' index applies
+                'correlated': False
+            } for alert in alerts]
+            self.alerts.insert_many(documents)
+            for document in documents:
+                self.incident_builder.add(document)
         
         return alerts
     
     def alert_correlator(self):
-        """Correlate alerts into higher-level incidents"""
+        """Write incidents built from alerts as the correlation stage raises them"""
+        self.recover_uncorrelated_alerts()
+        interval = self.config.get('incident_flush_interval', 2.0)
         while self.running:
+            time.sleep(interval)
             try:
-                # Get unprocessed alerts
-                alerts = list(self.alerts.find({
-                    'correlated': {'$exists': False}
-                }).limit(100))
-                
-                if alerts:
-                    # Group by source IP
-                    ip_alerts = {}
-                    for alert in alerts:
-                        ip = alert.get('source_ip') or alert.get('src_ip')
-                        if ip not in ip_alerts:
-                            ip_alerts[ip] = []
-                        ip_alerts[ip].append(alert)
-                    
-                    # Create incidents for IPs with multiple alerts
-                    for ip, ip_alert_list in ip_alerts.items():
-                        if len(ip_alert_list) > 2:
-                            incident = {
-                                'timestamp': datetime.utcnow().isoformat(),
-                                'source_ip': ip,
-                                'alert_count': len(ip_alert_list),
-                                'alerts': [a['_id'] for a in ip_alert_list],
-                                'severity': max(a['severity'] for a in ip_alert_list),
-                                'status': 'open'
-                            }
-                            
-                            self.db.incidents.insert_one(incident)
-                    
-                    # Mark alerts as correlated
-                    self.alerts.update_many(
-                        {'_id': {'$in': [a['_id'] for a in alerts]}},
-                        {'$set': {'correlated': True}}
-                    )
-                
-                time.sleep(10)
+                self.incident_builder.flush()
             except Exception as e:
                 self.logger.error(f"Alert correlation error: {str(e)}")
-                time.sleep(30)
+    
+    def recover_uncorrelated_alerts(self, limit=10000):
+        """Feed alerts left uncorrelated by a crash or failed flush back in"""
+        try:
+            alerts = self.alerts.find(
+                {'correlated': False}
+            ).sort('created_at', 1).limit(limit)
+            count = 0
+            for alert in alerts:
+                self.incident_builder.add(alert)
+                count += 1
+            if count:
+                self.logger.info(f"Re-queued {count} uncorrelated alerts for incident building")
+        except Exception as e:
+            self.logger.error(f"Alert recovery error: {str(e)}")
+
+def build_syslog_handler(config_file, metrics_port, index):
+    """Create an ingest-only pipeline inside a syslog worker process"""
+    sentry = OculusSentry(config_file, metrics_port=metrics_port + 1 + index, ingest_only=True)
+    for writer in sentry.writers.values():
+        writer.start()
+    return sentry.handle_syslog_batch
 
 if __name__ == '__main__':
     sentry = OculusSentry()
@@ -0,0 +1,342 @@
+# AEGIS-SHIELD :: Oculus Sentry :: NetFlow/IPFIX Collector
+# Path: /monitoring/oculus_sentry/netflow_collector.py
+import logging
+import socket
+import struct
+import time
+from datetime import datetime
+
+V5_HEADER = struct.Struct('!HHIIIIBBH')
+V5_RECORD = struct.Struct('!4s4s4sHHIIIIHHBBBBHHBBH')
+V9_HEADER = struct.Struct('!HHIIII')
+IPFIX_HEADER = struct.Struct('!HHIII')
+SET_HEADER = struct.Struct('!HH')
+FIELD_SPEC = struct.Struct('!HH')
+UINT32 = struct.Struct('!I')
+
+MAX_DATAGRAM = 65535
+
+# Information elements kept in the compact flow record (same ids in v9 and IPFIX)
+FIELDS = {
+    1: 'bytes', 2: 'packets', 4: 'proto', 5: 'tos', 6: 'tcp_flags',
+    7: 'src_port', 8: 'src_ip', 10: 'input_if', 11: 'dst_port', 12: 'dst_ip',
+    14: 'output_if', 21: 'last_switched', 22: 'first_switched',
+    27: 'src_ip', 28: 'dst_ip', 85: 'bytes', 86: 'packets',
+    150: 'start_s', 151: 'end_s', 152: 'start_ms', 153: 'end_ms'
+}
+ADDRESS_FIELDS = {8: socket.AF_INET, 12: socket.AF_INET, 27: socket.AF_INET6, 28: socket.AF_INET6}
+ADDRESS_LENGTHS = {socket.AF_INET: 4, socket.AF_INET6: 16}
+INT_CODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+VARIABLE_LENGTH = 65535
+
+
+def valid_template(fields):
+    """False for templates a record could not be safely decoded with.
+
+    A record must take at least one byte (a zero-length one would never
+    advance the data set offset), and kept address fields must have their
+    address family's length.
+    """
+    if sum(1 if length == VARIABLE_LENGTH else length for _, length in fields) == 0:
+        return False
+    for field_id, length in fields:
+        family = ADDRESS_FIELDS.get(field_id)
+        if family is not None and length != ADDRESS_LENGTHS[family]:
+            return False
+    return True
+
+
+class FlowTemplate:
+    """A v9/IPFIX template compiled to one struct per record.
+
+    Fields we keep are unpacked as integers or raw address bytes; all other
+    fields become pad bytes, so they cost nothing at decode time. Templates
+    with variable-length fields fall back to a per-field walk.
+    """
+
+    def __init__(self, fields, options=False):
+        self.fields = fields
+        self.options = options
+        self.variable = any(length == VARIABLE_LENGTH for _, length in fields)
+        self.names = []
+        self.converters = []
+        codes = ['!']
+        for field_id, length in fields:
+            name = FIELDS.get(field_id)
+            if name is None or self.variable:
+                codes.append(f'{length}x' if not self.variable else '')
+                continue
+            if field_id in ADDRESS_FIELDS:
+                codes.append(f'{length}s')
+                family = ADDRESS_FIELDS[field_id]
+                self.converters.append(lambda raw, family=family: socket.inet_ntop(family, raw))
+            elif length in INT_CODES:
+                codes.append(INT_CODES[length])
+                self.converters.append(None)
+            else:
+                codes.append(f'{length}s')
+                self.converters.append(lambda raw: int.from_bytes(raw, 'big'))
+            self.names.append(name)
+        self.struct = None if self.variable else struct.Struct(''.join(codes))
+        self.length = self.struct.size if self.struct else None
+
+    def records(self, buf, offset, end):
+        if self.struct is not None:
+            unpack = self.struct.unpack_from
+            size = self.length
+            names = self.names
+            converters = self.converters
+            # Trailing bytes shorter than one record are set padding
+            while offset + size <= end:
+                values = unpack(buf, offset)
+                offset += size
+                yield {
+                    name: value if convert is None else convert(value)
+                    for name, value, convert in zip(names, values, converters)
+                }
+        else:
+            while offset < end:
+                record, offset = self._walk(buf, offset, end)
+                if record is None:
+                    return
+                yield record
+
+    def _walk(self, buf, offset, end):
+        record = {}
+        for field_id, length in self.fields:
+            if length == VARIABLE_LENGTH:
+                if offset >= end:
+                    return None, end
+                length = buf[offset]
+                offset += 1
+                if length == 255:
+                    length = int.from_bytes(buf[offset:offset + 2], 'big')
+                    offset += 2
+            if offset + length > end:
+                return None, end
+            name = FIELDS.get(field_id)
+            if name is not None:
+                raw = bytes(buf[offset:offset + length])
+                if field_id in ADDRESS_FIELDS:
+                    record[name] = socket.inet_ntop(ADDRESS_FIELDS[field_id], raw)
+                else:
+                    record[name] = int.from_bytes(raw, 'big')
+            offset += length
+        return record, offset
+
+
+class NetflowDecoder:
+    """Decode NetFlow v5, v9 and IPFIX datagrams into compact flow records.
+
+    Templates are cached per ``(exporter, source id / observation domain,
+    template id)``; data sets that arrive before their template are counted
+    in ``stats['missing_template']`` and skipped. Templates failing
+    ``valid_template`` are dropped and counted in ``stats['bad_template']``.
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.stats = {'packets': 0, 'flows': 0, 'errors': 0, 'missing_template': 0,
+                      'bad_template': 0}
+
+    def decode(self, data, exporter):
+        buf = memoryview(data)
+        if len(buf) < 2:
+            raise ValueError("datagram too short")
+        version = int.from_bytes(buf[:2], 'big')
+        self.stats['packets'] += 1
+        if version == 5:
+            flows = self._decode_v5(buf, exporter)
+        elif version == 9:
+            flows = self._decode_v9(buf, exporter)
+        elif version == 10:
+            flows = self._decode_ipfix(buf, exporter)
+        else:
+            raise ValueError(f"unsupported flow version {version}")
+        self.stats['flows'] += len(flows)
+        return flows
+
+    def _decode_v5(self, buf, exporter):
+        _, count, uptime, secs, nsecs, _, _, _, _ = V5_HEADER.unpack_from(buf, 0)
+        flows = []
+        offset = V5_HEADER.size
+        for _ in range(count):
+            if offset + V5_RECORD.size > len(buf):
+                break
+            (src, dst, _, _, _, packets, octets, first, last, sport, dport,
+             _, flags, proto, _, _, _, _, _, _) = V5_RECORD.unpack_from(buf, offset)
+            offset += V5_RECORD.size
+            flows.append(self._compact({
+                'src_ip': socket.inet_ntoa(src),
+                'dst_ip': socket.inet_ntoa(dst),
+                'src_port': sport,
+                'dst_port': dport,
+                'proto': proto,
+                'tcp_flags': flags,
+                'bytes': octets,
+                'packets': packets
+            }, exporter, 5, secs - (uptime - last) / 1000.0))
+        return flows
+
+    def _decode_v9(self, buf, exporter):
+        _, _, uptime, secs, _, source_id = V9_HEADER.unpack_from(buf, 0)
+        flows = []
+        for set_id, offset, end in self._sets(buf, V9_HEADER.size):
+            if set_id == 0:
+                self._read_templates(buf, offset, end, (exporter, source_id), ipfix=False)
+            elif set_id == 1:
+                self._read_v9_options(buf, offset, end, (exporter, source_id))
+            elif set_id >= 256:
+                for record in self._data(buf, offset, end, (exporter, source_id, set_id)):
+                    when = secs
+                    if 'last_switched' in record:
+                        when = secs - (uptime - record['last_switched']) / 1000.0
+                    flows.append(self._compact(record, exporter, 9, when))
+        return flows
+
+    def _decode_ipfix(self, buf, exporter):
+        _, length, export_time, _, domain = IPFIX_HEADER.unpack_from(buf, 0)
+        buf = buf[:length]
+        flows = []
+        for set_id, offset, end in self._sets(buf, IPFIX_HEADER.size):
+            if set_id == 2:
+                self._read_templates(buf, offset, end, (exporter, domain), ipfix=True)
+            elif set_id == 3:
+                self._read_ipfix_options(buf, offset, end, (exporter, domain))
+            elif set_id >= 256:
+                for record in self._data(buf, offset, end, (exporter, domain, set_id)):
+                    if 'end_ms' in record:
+                        when = record['end_ms'] / 1000.0
+                    else:
+                        when = record.get('end_s', export_time)
+                    flows.append(self._compact(record, exporter, 10, when))
+        return flows
+
+    def _sets(self, buf, offset):
+        total = len(buf)
+        while offset + SET_HEADER.size <= total:
+            set_id, length = SET_HEADER.unpack_from(buf, offset)
+            if length < SET_HEADER.size or offset + length > total:
+                self.stats['errors'] += 1
+                return
+            yield set_id, offset + SET_HEADER.size, offset + length
+            offset += length
+
+    def _read_fields(self, buf, offset, count, ipfix):
+        fields = []
+        for _ in range(count):
+            field_id, length = FIELD_SPEC.unpack_from(buf, offset)
+            offset += FIELD_SPEC.size
+            if ipfix and field_id & 0x8000:
+                # Enterprise-specific element: never one of ours
+                field_id = 0x8000
+                offset += UINT32.size
+            fields.append((field_id, length))
+        return fields, offset
+
+    def _read_templates(self, buf, offset, end, scope, ipfix):
+        while offset + 4 <= end:
+            template_id, count = FIELD_SPEC.unpack_from(buf, offset)
+            offset += 4
+            if template_id < 256:
+                return
+            if count == 0:
+                # IPFIX template withdrawal
+                self.templates.pop(scope + (template_id,), None)
+                continue
+            fields, offset = self._read_fields(buf, offset, count, ipfix)
+            self._cache(scope + (template_id,), fields, options=False)
+
+    def _read_v9_options(self, buf, offset, end, scope):
+        # Options data (sampling rates etc.) is skipped, but the template is
+        # cached so its data sets are recognised rather than counted missing
+        while offset + 6 <= end:
+            template_id, scope_len, option_len = struct.unpack_from('!HHH', buf, offset)
+            offset += 6
+            count = (scope_len + option_len) // 4
+            if template_id < 256 or count == 0:
+                return
+            fields, offset = self._read_fields(buf, offset, count, ipfix=False)
+            self._cache(scope + (template_id,), fields, options=True)
+
+    def _read_ipfix_options(self, buf, offset, end, scope):
+        while offset + 6 <= end:
+            template_id, count, _ = struct.unpack_from('!HHH', buf, offset)
+            offset += 6
+            if template_id < 256 or count == 0:
+                return
+            fields, offset = self._read_fields(buf, offset, count, ipfix=True)
+            self._cache(scope + (template_id,), fields, options=True)
+
+    def _cache(self, key, fields, options):
+        if not valid_template(fields):
+            # Also forget any earlier template under this id
+            self.stats['bad_template'] += 1
+            self.templates.pop(key, None)
+            return
+        self.templates[key] = FlowTemplate(fields, options=options)
+
+    def _data(self, buf, offset, end, key):
+        template = self.templates.get(key)
+        if template is None:
+            self.stats['missing_template'] += 1
+            return ()
+        if template.options:
+            return ()
+        return template.records(buf, offset, end)
+
+    def _compact(self, record, exporter, version, when):
+        record['timestamp'] = datetime.utcfromtimestamp(when).isoformat()
+        record['exporter'] = exporter
+        record['flow_version'] = version
+        record['type'] = 'netflow'
+        record.pop('last_switched', None)
+        record.pop('first_switched', None)
+        return record
+
+
+class NetflowCollector:
+    """UDP intake that decodes straight out of a reused receive buffer"""
+
+    def __init__(self, handler, host='0.0.0.0', port=2055, rcvbuf=16 * 1024 * 1024,
+                 logger=None, timer=None):
+        self.handler = handler
+        self.timer = timer
+        self.host = host
+        self.port = port
+        self.rcvbuf = rcvbuf
+        self.logger = logger or logging.getLogger('NetflowCollector')
+        self.decoder = NetflowDecoder()
+        self.running = False
+
+    def serve_forever(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        sock.bind((self.host, self.port))
+        sock.settimeout(1.0)
+        buffer = bytearray(MAX_DATAGRAM)
+        view = memoryview(buffer)
+        self.running = True
+        self.logger.info(f"NetFlow/IPFIX collector listening on UDP {self.port}")
+
+        while self.running:
+            try:
+                size, addr = sock.recvfrom_into(buffer)
+            except socket.timeout:
+                continue
+            try:
+                if self.timer is not None and self.timer.should_sample():
+                    start = time.perf_counter()
+                    flows = self.decoder.decode(view[:size], addr[0])
+                    self.timer.observe('parse', time.perf_counter() - start)
+                else:
+                    flows = self.decoder.decode(view[:size], addr[0])
+            except (ValueError, struct.error) as e:
+                self.decoder.stats['errors'] += 1
+                self.logger.error(f"NetFlow decode error from {addr[0]}: {str(e)}")
+                continue
+            if flows:
+                self.handler(flows)
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,216 @@
+# AEGIS-SHIELD :: Oculus Sentry :: NetFlow/IPFIX Decoder Fixtures
+# Path: /monitoring/oculus_sentry/netflow_fixtures.py
+#
+# Binary NetFlow v5, v9 and IPFIX datagrams under fixtures/netflow/ and the
+# flows NetflowDecoder must produce from them. The datagrams are packed by
+# hand below (independently of the decoder) so their contents are readable;
+# --write regenerates the files, the default run decodes and checks them.
+#
+#   python netflow_fixtures.py            # exits non-zero on any mismatch
+#   python netflow_fixtures.py --write
+import argparse
+import os
+import socket
+import struct
+import sys
+
+from netflow_collector import NetflowDecoder
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'netflow')
+EXPORTER = '192.0.2.1'
+EXPORT_SECS = 1700000000
+UPTIME_MS = 3600000
+
+
+def _ip(address):
+    return socket.inet_aton(address)
+
+
+def _set(set_id, body):
+    return struct.pack('!HH', set_id, 4 + len(body)) + body
+
+
+def build_v5():
+    records = b''.join(
+        struct.pack('!4s4s4sHHIIIIHHBBBBHHBBH',
+                    _ip(src), _ip(dst), b'\0' * 4, 1, 2, packets, octets,
+                    UPTIME_MS - 2000, UPTIME_MS - 1000, sport, dport,
+                    0, flags, proto, 0, 0, 0, 24, 24, 0)
+        for src, dst, sport, dport, proto, flags, packets, octets in (
+            ('10.0.0.1', '10.0.0.2', 51000, 443, 6, 0x18, 10, 1500),
+            ('10.0.0.3', '8.8.8.8', 53000, 53, 17, 0, 1, 80)
+        )
+    )
+    return struct.pack('!HHIIIIBBH', 5, 2, UPTIME_MS, EXPORT_SECS, 0, 1, 0, 0, 0) + records
+
+
+V9_TEMPLATE = 256
+V9_OPTIONS_TEMPLATE = 257
+V9_FIELDS = ((8, 4), (12, 4), (7, 2), (11, 2), (4, 1), (1, 4), (2, 4), (21, 4), (61, 1))
+
+
+def _v9_header(count, sequence):
+    return struct.pack('!HHIIII', 9, count, UPTIME_MS, EXPORT_SECS, sequence, 42)
+
+
+def _v9_data():
+    # The trailing 3 bytes are set padding, shorter than one record
+    return _set(V9_TEMPLATE, b''.join(
+        struct.pack('!4s4sHHBIIIB', _ip(src), _ip(dst), sport, dport, proto,
+                    octets, packets, UPTIME_MS - 5000, 0)
+        for src, dst, sport, dport, proto, octets, packets in (
+            ('172.16.0.5', '172.16.0.9', 40000, 22, 6, 4200, 12),
+            ('172.16.0.6', '192.0.2.80', 40001, 80, 6, 900, 3)
+        )
+    ) + b'\0' * 3)
+
+
+def build_v9_data_before_template():
+    return _v9_header(2, 1) + _v9_data()
+
+
+def build_v9_template_and_data():
+    template = struct.pack('!HH', V9_TEMPLATE, len(V9_FIELDS)) + b''.join(
+        struct.pack('!HH', *field) for field in V9_FIELDS)
+    # Options template (scope: system, option: sampling interval) and its data,
+    # which must be recognised and skipped rather than decoded as flows
+    options = struct.pack('!HHHHHHH', V9_OPTIONS_TEMPLATE, 4, 4, 1, 4, 34, 4)
+    return (_v9_header(4, 2) + _set(0, template) + _set(1, options)
+            + _set(V9_OPTIONS_TEMPLATE, struct.pack('!II', 1, 100)) + _v9_data())
+
+
+def build_v9_bad_templates():
+    # A zero-length record (one 0-byte field) would never advance the data
+    # set offset; a 2-byte IPv4 address cannot be converted. Both templates
+    # must be rejected and their data sets skipped as having no template.
+    templates = (struct.pack('!HHHH', 258, 1, 1, 0)
+                 + struct.pack('!HHHHHH', 259, 2, 8, 2, 1, 4))
+    return (_v9_header(3, 3) + _set(0, templates)
+            + _set(258, b'\0' * 16) + _set(259, b'\0' * 12))
+
+
+IPFIX_TEMPLATE = 300
+
+
+def _varlen(value):
+    if len(value) < 255:
+        return struct.pack('!B', len(value)) + value
+    return struct.pack('!BH', 255, len(value)) + value
+
+
+def build_ipfix():
+    # Includes a variable-length element (96, applicationName) and an
+    # enterprise-specific element, so the per-field walk is exercised
+    template = struct.pack(
+        '!HH' + 'HH' * 6 + 'HHI' + 'HH' * 2,
+        IPFIX_TEMPLATE, 9,
+        27, 16, 28, 16, 7, 2, 11, 2, 4, 1, 85, 8,
+        0x8000 | 100, 4, 9,
+        96, 65535, 153, 8
+    )
+    records = b''.join(
+        struct.pack('!16s16sHHBQ', socket.inet_pton(socket.AF_INET6, src),
+                    socket.inet_pton(socket.AF_INET6, dst), sport, dport, 6, octets)
+        + struct.pack('!I', 7) + _varlen(app) + struct.pack('!Q', end_ms)
+        for src, dst, sport, dport, octets, app, end_ms in (
+            ('2001:db8::1', '2001:db8::2', 50000, 443, 123456, b'https', 1700000001500),
+            ('2001:db8::3', '2001:db8::4', 50001, 8443, 999, b'x' * 300, 1700000002000)
+        )
+    )
+    body = _set(2, template) + _set(IPFIX_TEMPLATE, records)
+    return struct.pack('!HHIII', 10, 16 + len(body), EXPORT_SECS, 7, 99) + body
+
+
+FIXTURES = {
+    'v5.bin': build_v5,
+    'v9_data_before_template.bin': build_v9_data_before_template,
+    'v9_template_and_data.bin': build_v9_template_and_data,
+    'v9_bad_templates.bin': build_v9_bad_templates,
+    'ipfix_variable_length.bin': build_ipfix
+}
+
+V9_FLOWS = [
+    {'src_ip': '172.16.0.5', 'dst_ip': '172.16.0.9', 'src_port': 40000, 'dst_port': 22,
+     'proto': 6, 'bytes': 4200, 'packets': 12, 'timestamp': '2023-11-14T22:13:15'},
+    {'src_ip': '172.16.0.6', 'dst_ip': '192.0.2.80', 'src_port': 40001, 'dst_port': 80,
+     'proto': 6, 'bytes': 900, 'packets': 3, 'timestamp': '2023-11-14T22:13:15'}
+]
+
+# (fixture, expected flows, expected missing_template and bad_template
+# deltas), decoded in order through one decoder, so template state carries
+# over between steps
+EXPECTED = [
+    ('v5.bin', [
+        {'src_ip': '10.0.0.1', 'dst_ip': '10.0.0.2', 'src_port': 51000, 'dst_port': 443,
+         'proto': 6, 'tcp_flags': 0x18, 'bytes': 1500, 'packets': 10,
+         'timestamp': '2023-11-14T22:13:19'},
+        {'src_ip': '10.0.0.3', 'dst_ip': '8.8.8.8', 'src_port': 53000, 'dst_port': 53,
+         'proto': 17, 'tcp_flags': 0, 'bytes': 80, 'packets': 1,
+         'timestamp': '2023-11-14T22:13:19'}
+    ], 0, 0),
+    # No template cached yet: the data set is skipped and counted
+    ('v9_data_before_template.bin', [], 1, 0),
+    ('v9_template_and_data.bin', V9_FLOWS, 0, 0),
+    # Same datagram again, now that the template is known
+    ('v9_data_before_template.bin', V9_FLOWS, 0, 0),
+    ('v9_bad_templates.bin', [], 2, 2),
+    ('ipfix_variable_length.bin', [
+        {'src_ip': '2001:db8::1', 'dst_ip': '2001:db8::2', 'src_port': 50000, 'dst_port': 443,
+         'proto': 6, 'bytes': 123456, 'timestamp': '2023-11-14T22:13:21.500000'},
+        {'src_ip': '2001:db8::3', 'dst_ip': '2001:db8::4', 'src_port': 50001, 'dst_port': 8443,
+         'proto': 6, 'bytes': 999, 'timestamp': '2023-11-14T22:13:22'}
+    ], 0, 0)
+]
+
+# Added by the decoder to every flow; checked separately from the fields above
+COMMON = {'exporter': EXPORTER, 'type': 'netflow'}
+VERSIONS = {'v5': 5, 'v9': 9, 'ipfix': 10}
+
+
+def write_fixtures(directory=FIXTURE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    for name, build in FIXTURES.items():
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(build())
+
+
+def check_fixtures(directory=FIXTURE_DIR):
+    """Decode every fixture in order; returns a list of failure messages"""
+    decoder = NetflowDecoder()
+    failures = []
+    for name, expected, missing, bad in EXPECTED:
+        with open(os.path.join(directory, name), 'rb') as f:
+            data = f.read()
+        if data != FIXTURES[name]():
+            failures.append(f"{name}: file differs from its builder (run --write?)")
+        before = dict(decoder.stats)
+        flows = decoder.decode(data, EXPORTER)
+        version = VERSIONS[name.split('_')[0].split('.')[0]]
+        wanted = [dict(flow, flow_version=version, **COMMON) for flow in expected]
+        # Fields outside the fixture's expectations (e.g. ipfix end_ms) are ignored
+        got = [{key: flow.get(key) for key in want} for flow, want in zip(flows, wanted)]
+        if len(flows) != len(wanted) or got != wanted:
+            failures.append(f"{name}: expected {wanted}, decoded {flows}")
+        for stat, wanted_delta in (('missing_template', missing), ('bad_template', bad)):
+            delta = decoder.stats[stat] - before[stat]
+            if delta != wanted_delta:
+                failures.append(f"{name}: expected {stat} +{wanted_delta}, counted +{delta}")
+    if decoder.stats['errors']:
+        failures.append(f"decoder counted {decoder.stats['errors']} malformed set(s)")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='NetFlow/IPFIX decoder fixtures')
+    parser.add_argument('--write', action='store_true', help='regenerate the fixture files')
+    args = parser.parse_args()
+
+    if args.write:
+        write_fixtures()
+        print(f"Wrote {len(FIXTURES)} fixtures to {FIXTURE_DIR}")
+    failures = check_fixtures()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{len(EXPECTED) - len(failures)}/{len(EXPECTED)} fixture checks passed" if not failures
+          else f"{len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,66 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Pipeline Metrics Helpers
+# Path: /monitoring/oculus_sentry/pipeline_metrics.py
+import math
+import threading
+import time
+
+STAGE_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.25, 1.0)
+
+
+class StageTimer:
+    """Sampled stage timing for one event source.
+
+    Callers ask ``should_sample()`` once per datagram or batch and only
+    read the clock when it says so, so one in ``sample_every`` units pays
+    for timing and histogram observations. Labelled children are resolved
+    up front to keep ``labels()`` lookups off the hot path too.
+    """
+
+    def __init__(self, histogram, source, stages, sample_every=100):
+        self.sample_every = max(1, int(sample_every))
+        self.children = {
+            stage: histogram.labels(stage=stage, source=source) for stage in stages
+        } if histogram is not None else {}
+        self._tick = 0
+
+    def should_sample(self):
+        if not self.children:
+            return False
+        self._tick += 1
+        if self._tick >= self.sample_every:
+            self._tick = 0
+            return True
+        return False
+
+    def observe(self, stage, seconds):
+        self.children[stage].observe(seconds)
+
+
+class ThreatLevel:
+    """Alert pressure on a 0-``ceiling`` scale that decays exponentially.
+
+    Each alert adds ``per_alert``; the level halves every ``half_life``
+    seconds without alerts. Decay is applied lazily on read or update, so
+    the gauge can read ``value`` through ``set_function`` at scrape time.
+    """
+
+    def __init__(self, half_life=300, per_alert=0.1, ceiling=10.0):
+        self.decay = math.log(2) / half_life
+        self.per_alert = per_alert
+        self.ceiling = ceiling
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _decayed(self, now):
+        return self.level * math.exp(-self.decay * (now - self.updated))
+
+    def add(self, alerts=1):
+        now = time.monotonic()
+        with self.lock:
+            self.level = min(self.ceiling, self._decayed(now) + self.per_alert * alerts)
+            self.updated = now
+
+    def value(self):
+        with self.lock:
+            return self._decayed(time.monotonic())
@@ -0,0 +1,218 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Response Action Executor
+# Path: /monitoring/oculus_sentry/response_executor.py
+import ipaddress
+import logging
+import queue
+import subprocess
+import threading
+import time
+
+from rule_repository import field_getter
+
+BLOCKLIST_SET = 'aegis-blocklist'
+BLOCKLIST_CHAIN = 'INPUT'
+MAX_APPLY_BACKOFF = 30.0
+
+
+class ResponseExecutor:
+    """Run alert response actions off the consumer thread.
+
+    ``submit`` only enqueues, so detection never waits on a response. Worker
+    threads dispatch each alert's actions; IP blocks are not applied one by
+    one but collected into a pending set, where a thousand alerts for the
+    same address coalesce into one entry, and a flusher thread applies the
+    whole set with a single ``ipset restore``. Addresses already blocked are
+    remembered until their ipset timeout lapses, which keeps re-submission
+    idempotent. Only well-formed IPv4 addresses are accepted, since they are
+    written into the ``ipset restore`` script (and the set is ``hash:ip``
+    IPv4); a failed apply puts its addresses back and is retried with
+    backoff. When enforcing, ``start`` first makes sure an iptables rule
+    drops traffic from the set's members.
+    """
+
+    def __init__(self, workers=4, queue_size=10000, batch_size=500, flush_interval=0.5,
+                 block_ttl=3600, dry_run=True, ipset=BLOCKLIST_SET, chain=BLOCKLIST_CHAIN,
+                 metrics=None, logger=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_ttl = block_ttl
+        self.dry_run = dry_run
+        self.ipset = ipset
+        self.chain = chain
+        self.metrics = metrics
+        self.logger = logger or logging.getLogger('ResponseExecutor')
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = set()
+        self.blocked = {}
+        self.lock = threading.Lock()
+        self.flush_now = threading.Event()
+        self.running = False
+        self.threads = []
+        self.source_ip = field_getter('source.ip')
+        self.handlers = {
+            'block_ip': self.block_ip,
+            'isolate_host': self._notify,
+            'alert_soc': self._notify,
+            'alert_forensics': self._notify
+        }
+
+    def start(self):
+        if not self.dry_run:
+            self._ensure_drop_rule()
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(self.workers)
+        ]
+        self.threads.append(threading.Thread(target=self._flusher, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        self.logger.info(
+            f"Response executor started ({self.workers} workers, "
+            f"{'dry run' if self.dry_run else 'enforcing'})")
+
+    def stop(self, timeout=5):
+        self.running = False
+        self.flush_now.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def submit(self, alert):
+        """Queue an alert for response; returns False when the queue is full"""
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            self._count('response_dropped')
+            return False
+        self._count('response_submitted')
+        return True
+
+    def _worker(self):
+        while self.running:
+            try:
+                alert = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                for action in self._actions(alert):
+                    handler = self.handlers.get(action)
+                    if handler is None:
+                        self.logger.warning(f"No handler for response action {action}")
+                        continue
+                    handler(alert)
+            except Exception as e:
+                self._count('response_failures')
+                self.logger.error(f"Response error for {alert.get('alert_id')}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def _actions(self, alert):
+        # Critical alerts always block the source, as the inline handler did
+        actions = list(alert.get('actions', []))
+        if 'block_ip' not in actions:
+            actions.insert(0, 'block_ip')
+        return actions
+
+    def block_ip(self, alert):
+        ip = self.source_ip(alert['event'])
+        if not ip:
+            return
+        try:
+            ip = str(ipaddress.IPv4Address(str(ip)))
+        except ValueError:
+            self._count('response_rejected')
+            self.logger.warning(f"Not blocking invalid source IP {ip!r} from alert {alert.get('alert_id')}")
+            return
+        now = time.time()
+        with self.lock:
+            if ip in self.pending or self.blocked.get(ip, 0) > now:
+                self._count('response_coalesced')
+                return
+            self.pending.add(ip)
+            if len(self.pending) >= self.batch_size:
+                self.flush_now.set()
+
+    def _notify(self, alert):
+        self.logger.warning(
+            f"Response action for {alert['rule']} alert {alert['alert_id']}: "
+            f"{', '.join(alert.get('actions', []))}")
+
+    def _flusher(self):
+        backoff = 0.0
+        retry_at = 0.0
+        while self.running or self.pending:
+            self.flush_now.wait(self.flush_interval)
+            self.flush_now.clear()
+            # After a failure, wait out the backoff (but try once more on stop)
+            if self.running and time.monotonic() < retry_at:
+                continue
+            with self.lock:
+                if not self.pending:
+                    continue
+                ips = sorted(self.pending)
+                self.pending.clear()
+            try:
+                self._apply(ips)
+                backoff = 0.0
+            except Exception as e:
+                self._count('response_failures')
+                if not self.running:
+                    self.logger.error(f"Blocklist apply failed on shutdown, {len(ips)} IPs not blocked: {str(e)}")
+                    return
+                with self.lock:
+                    self.pending.update(ips)
+                backoff = min(max(backoff * 2, self.flush_interval), MAX_APPLY_BACKOFF)
+                retry_at = time.monotonic() + backoff
+                self.logger.error(
+                    f"Blocklist apply failed for {len(ips)} IPs, retrying in {backoff:.1f}s: {str(e)}")
+
+    def _ensure_drop_rule(self):
+        """Create the ipset and the iptables rule dropping its members.
+
+        Filling the set blocks nothing on its own. Raises if either step
+        fails, so an enforcing executor never starts without the DROP rule.
+        """
+        subprocess.run(
+            ['ipset', 'create', self.ipset, 'hash:ip', 'timeout', str(self.block_ttl), '-exist'],
+            check=True,
+            timeout=30
+        )
+        rule = [self.chain, '-m', 'set', '--match-set', self.ipset, 'src', '-j', 'DROP']
+        if subprocess.run(['iptables', '-C'] + rule, capture_output=True, timeout=30).returncode != 0:
+            subprocess.run(['iptables', '-I'] + rule, check=True, timeout=30)
+            self.logger.warning(f"Inserted {self.chain} DROP rule for ipset {self.ipset}")
+
+    def _apply(self, ips):
+        """Apply a batch of blocks with one ipset restore"""
+        start = time.perf_counter()
+        payload = [f"create {self.ipset} hash:ip timeout {self.block_ttl} -exist"]
+        payload.extend(f"add {self.ipset} {ip} timeout {self.block_ttl} -exist" for ip in ips)
+
+        if self.dry_run:
+            self.logger.warning(f"[dry run] Blocking {len(ips)} IPs: {', '.join(ips[:20])}")
+        else:
+            subprocess.run(
+                ['ipset', 'restore'],
+                input='\n'.join(payload) + '\n',
+                text=True,
+                check=True,
+                timeout=30
+            )
+            self.logger.warning(f"Blocked {len(ips)} IPs via ipset {self.ipset}")
+
+        now = time.time()
+        expires = now + self.block_ttl
+        with self.lock:
+            for ip in ips:
+                self.blocked[ip] = expires
+            for ip in [ip for ip, until in self.blocked.items() if until <= now]:
+                del self.blocked[ip]
+
+        if self.metrics:
+            self.metrics['response_blocked'].inc(len(ips))
+            self.metrics['response_apply_time'].observe(time.perf_counter() - start)
+
+    def _count(self, name):
+        if self.metrics:
+            self.metrics[name].inc()
@@ -0,0 +1,59 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Rule Evaluation Profiler
+# Path: /monitoring/oculus_sentry/rule_profiler.py
+from collections import defaultdict
+
+
+class RuleProfiler:
+    """Sampled per-rule evaluation timing.
+
+    Only one in ``sample_every`` events is timed, so the per-rule clock reads
+    and histogram observations stay off most of the hot path. Sampled
+    durations feed the Prometheus histogram and a cumulative per-rule total
+    that ``hottest()`` ranks on demand.
+    """
+
+    def __init__(self, histogram=None, sample_every=1):
+        self.histogram = histogram
+        self.sample_every = max(1, int(sample_every))
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._children = {}
+        self._tick = 0
+
+    def should_sample(self):
+        self._tick += 1
+        if self._tick >= self.sample_every:
+            self._tick = 0
+            return True
+        return False
+
+    def record(self, rule_id, seconds):
+        self.totals[rule_id] += seconds
+        self.calls[rule_id] += 1
+        if self.histogram is not None:
+            child = self._children.get(rule_id)
+            if child is None:
+                child = self._children[rule_id] = self.histogram.labels(rule=rule_id)
+            child.observe(seconds)
+
+    def hottest(self, limit=10):
+        ranked = sorted(self.totals.items(), key=lambda item: -item[1])[:limit]
+        return [
+            {
+                'rule': rule_id,
+                'sampled_seconds': round(total, 6),
+                'sampled_calls': self.calls[rule_id],
+                'mean_us': round(total / self.calls[rule_id] * 1e6, 2)
+            }
+            for rule_id, total in ranked
+        ]
+
+    def dump(self, logger, limit=10):
+        for entry in self.hottest(limit):
+            logger.info(
+                f"Hot rule {entry['rule']}: {entry['mean_us']}us mean over "
+                f"{entry['sampled_calls']} sampled evaluations")
+
+    def reset(self):
+        self.totals.clear()
+        self.calls.clear()
@@ -0,0 +1,425 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Correlation Rule Repository
+# Path: /monitoring/oculus_sentry/rule_repository.py
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+import yaml
+
+from sliding_window import SlidingWindow
+
+CODENAME = "SENTRY-RULES"
+VERSION = "1.0-RULES"
+
+RULE_DIR = 'monitoring/oculus_sentry/correlation_rules'
+RULE_EXTENSIONS = ('.yaml', '.yml')
+SEVERITIES = ('low', 'medium', 'high', 'critical')
+CONDITION_TYPES = ('equals', 'regex')
+
+
+class RuleValidationError(ValueError):
+    pass
+
+
+def field_getter(path):
+    """Build an accessor for a dotted field name.
+
+    Flat keys such as ``"source.ip"`` are tried first, then the nested
+    ``event['source']['ip']`` form used by ECS documents.
+    """
+    parts = path.split('.')
+
+    def get(event):
+        value = event.get(path)
+        if value is not None:
+            return value
+        value = event
+        for part in parts:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+
+    return get
+
+
+def event_time(event, default=None):
+    """Return the event's ``@timestamp`` as epoch seconds.
+
+    Accepts ISO 8601 strings (with or without a ``Z`` suffix, naive values
+    are taken as UTC) and numeric epochs in seconds or milliseconds.
+    """
+    value = event.get('@timestamp', event.get('timestamp'))
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return value / 1000.0 if value > 1e11 else float(value)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return default
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class CompiledRule:
+    """Validated correlation rule with precompiled matchers and window state"""
+
+    def __init__(self, spec, source, fingerprint):
+        self.spec = spec
+        self.source = source
+        self.fingerprint = fingerprint
+        self.id = spec['id']
+        self.name = spec.get('name', self.id)
+        self.severity = spec['severity']
+        self.actions = [a['type'] for a in spec.get('actions', [])]
+        self.threshold = int(spec.get('threshold', 1))
+        self.timeframe = spec.get('timeframe')
+        self.group_by = field_getter(spec.get('group_by', 'source.ip'))
+        self.matchers = compile_conditions(spec['conditions'])
+        self.window = None
+        if self.timeframe:
+            self.window = SlidingWindow(float(self.timeframe) * 60)
+
+    def entity(self, event):
+        return self.group_by(event)
+
+    def matches(self, event):
+        """Check field conditions only"""
+        return _all_match(self.matchers, event)
+
+    def evaluate(self, event, now):
+        """Check conditions and, for windowed rules, the count threshold"""
+        if not self.matches(event):
+            return False
+        if self.window is None:
+            return True
+        return self.window.add(self.entity(event), now) >= self.threshold
+
+
+class SequenceStep:
+    def __init__(self, spec, default_group_by):
+        self.name = spec.get('name')
+        self.threshold = int(spec.get('threshold', 1))
+        self.group_by = field_getter(spec.get('group_by', default_group_by))
+        self.matchers = compile_conditions(spec['conditions'])
+
+    def matches(self, event):
+        return _all_match(self.matchers, event)
+
+
+class SequenceRule:
+    """Ordered multi-step rule ("A then B within N minutes") per entity.
+
+    Each key (the step's ``group_by`` value) holds a small state machine:
+    the step it is waiting on, how many events that step has seen, and when
+    the sequence started. A sequence that has not completed ``within`` its
+    time limit is discarded. Steps may key on different fields so chains can
+    hop between hosts, e.g. a logon *to* a host followed by a scan *from* it.
+
+    States live in an OrderedDict in last-update order, so stale keys are
+    expired from the front and ``max_keys`` evicts the least recently
+    active sequences under high key cardinality. Time is whatever ``now``
+    the caller passes, so live and replay runs share the same semantics.
+    """
+
+    def __init__(self, spec, source, fingerprint):
+        self.spec = spec
+        self.source = source
+        self.fingerprint = fingerprint
+        self.id = spec['id']
+        self.name = spec.get('name', self.id)
+        self.severity = spec['severity']
+        self.actions = [a['type'] for a in spec.get('actions', [])]
+        self.within = float(spec['within']) * 60
+        self.max_keys = int(spec.get('max_keys', 100000))
+        group_by = spec.get('group_by', 'source.ip')
+        self.steps = [SequenceStep(step, group_by) for step in spec['sequence']]
+        self.states = OrderedDict()
+
+    def entity(self, event):
+        return self.steps[-1].group_by(event)
+
+    def matches(self, event):
+        return any(step.matches(event) for step in self.steps)
+
+    def _expire(self, now):
+        cutoff = now - self.within
+        while self.states:
+            key, state = next(iter(self.states.items()))
+            if state[3] > cutoff:
+                break
+            self.states.popitem(last=False)
+
+    def evaluate(self, event, now):
+        """Advance the event's sequences; True when one completes"""
+        self._expire(now)
+        last = len(self.steps) - 1
+        completed = False
+
+        # Walk steps backwards so one event never advances a key twice
+        for index in range(last, -1, -1):
+            step = self.steps[index]
+            if not step.matches(event):
+                continue
+            key = step.group_by(event)
+            if key is None:
+                continue
+
+            state = self.states.get(key)
+            if state is not None and now - state[2] > self.within:
+                del self.states[key]
+                state = None
+
+            if state is None:
+                if index != 0:
+                    continue
+                # [waiting step, count at step, started, last update]
+                state = [0, 0, now, now]
+                self.states[key] = state
+                if len(self.states) > self.max_keys:
+                    self.states.popitem(last=False)
+            elif state[0] != index:
+                continue
+
+            state[1] += 1
+            state[3] = now
+            self.states.move_to_end(key)
+            if state[1] < step.threshold:
+                continue
+            if index == last:
+                del self.states[key]
+                completed = True
+            else:
+                state[0] = index + 1
+                state[1] = 0
+
+        return completed
+
+    def __len__(self):
+        return len(self.states)
+
+
+def compile_conditions(conditions):
+    return [_compile_condition(c) for c in conditions]
+
+
+def _compile_condition(condition):
+    get = field_getter(condition['field'])
+    if condition['type'] == 'regex':
+        pattern = re.compile(condition['pattern'])
+        return lambda event: _regex_test(pattern, get(event))
+    expected = str(condition['value'])
+    return lambda event: _equals_test(expected, get(event))
+
+
+def _all_match(matchers, event):
+    for matcher in matchers:
+        if not matcher(event):
+            return False
+    return True
+
+
+def _regex_test(pattern, value):
+    if not value:
+        return False
+    return pattern.match(str(value)) is not None
+
+
+def _equals_test(expected, value):
+    if not value:
+        return False
+    return str(value) == expected
+
+
+class RuleSet:
+    """Immutable snapshot of compiled rules swapped in as a whole"""
+
+    def __init__(self, rules, generation):
+        self.rules = tuple(rules)
+        self.by_id = {rule.id: rule for rule in self.rules}
+        self.generation = generation
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+
+RULE_TYPES = {
+    'threshold': CompiledRule,
+    'sequence': SequenceRule
+}
+
+
+class RuleRepository:
+    def __init__(self, rule_dir=RULE_DIR, poll_interval=5, logger=None):
+        self.rule_dir = rule_dir
+        self.poll_interval = poll_interval
+        self.logger = logger or logging.getLogger(CODENAME)
+        self.ruleset = RuleSet([], 0)
+        self._snapshot = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def validate(self, spec, source):
+        if not isinstance(spec, dict):
+            raise RuleValidationError(f"{source}: rule must be a mapping")
+        rule_type = spec.get('type', 'threshold')
+        if rule_type not in RULE_TYPES:
+            raise RuleValidationError(f"{source}: unknown rule type '{rule_type}'")
+        required = ('id', 'severity', 'sequence', 'within') if rule_type == 'sequence' \
+            else ('id', 'severity', 'conditions')
+        for key in required:
+            if key not in spec:
+                raise RuleValidationError(f"{source}: missing '{key}'")
+        if not isinstance(spec['id'], str):
+            raise RuleValidationError(f"{source}: id must be a string")
+        if spec['severity'] not in SEVERITIES:
+            raise RuleValidationError(f"{source}: unknown severity '{spec['severity']}'")
+        actions = spec.get('actions', [])
+        if not isinstance(actions, list) or not all(
+                isinstance(action, dict) and isinstance(action.get('type'), str) for action in actions):
+            raise RuleValidationError(f"{source}: actions must be a list of mappings with a type")
+        self._validate_field(spec, 'group_by', source)
+        self._validate_number(spec, 'threshold', source, integer=True)
+
+        if rule_type == 'sequence':
+            if not isinstance(spec['sequence'], list) or len(spec['sequence']) < 2:
+                raise RuleValidationError(f"{source}: a sequence needs at least two steps")
+            self._validate_number(spec, 'within', source)
+            self._validate_number(spec, 'max_keys', source, integer=True)
+            for step in spec['sequence']:
+                if not isinstance(step, dict) or 'conditions' not in step:
+                    raise RuleValidationError(f"{source}: sequence step without conditions")
+                self._validate_field(step, 'group_by', source)
+                self._validate_number(step, 'threshold', source, integer=True)
+                self._validate_conditions(step['conditions'], source)
+        else:
+            self._validate_conditions(spec['conditions'], source)
+            self._validate_number(spec, 'timeframe', source)
+
+    @staticmethod
+    def _validate_number(spec, key, source, integer=False):
+        # Optional positive number; YAML booleans are ints, so refuse them
+        value = spec.get(key)
+        if value is None:
+            return
+        kinds = (int,) if integer else (int, float)
+        if isinstance(value, bool) or not isinstance(value, kinds):
+            kind = 'an integer' if integer else 'a number'
+            raise RuleValidationError(f"{source}: {key} must be {kind}, got {value!r}")
+        if value <= 0:
+            raise RuleValidationError(f"{source}: {key} must be positive")
+
+    @staticmethod
+    def _validate_field(spec, key, source):
+        if key in spec and not isinstance(spec[key], str):
+            raise RuleValidationError(f"{source}: {key} must be a field name")
+
+    def _validate_conditions(self, conditions, source):
+        if not conditions:
+            raise RuleValidationError(f"{source}: rule has no conditions")
+        if not isinstance(conditions, list):
+            raise RuleValidationError(f"{source}: conditions must be a list")
+        for condition in conditions:
+            if not isinstance(condition, dict):
+                raise RuleValidationError(f"{source}: condition must be a mapping, got {condition!r}")
+            self._validate_field(condition, 'field', source)
+            if condition.get('type') not in CONDITION_TYPES:
+                raise RuleValidationError(
+                    f"{source}: unknown condition type '{condition.get('type')}'")
+            if 'field' not in condition:
+                raise RuleValidationError(f"{source}: condition without field")
+            if condition['type'] == 'regex':
+                try:
+                    re.compile(condition['pattern'])
+                except (KeyError, TypeError, re.error) as e:
+                    raise RuleValidationError(f"{source}: bad pattern ({e})")
+            elif 'value' not in condition:
+                raise RuleValidationError(f"{source}: equals condition without value")
+
+    def _scan(self):
+        snapshot = {}
+        for name in sorted(os.listdir(self.rule_dir)):
+            if not name.endswith(RULE_EXTENSIONS):
+                continue
+            path = os.path.join(self.rule_dir, name)
+            stat = os.stat(path)
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _compile_file(self, path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        fingerprint = hashlib.sha256(raw).hexdigest()
+        spec = yaml.safe_load(raw)
+        self.validate(spec, path)
+        return spec, fingerprint
+
+    def reload(self):
+        """Recompile the rule directory and atomically swap the ruleset.
+
+        Rules whose file content is unchanged keep their compiled object and
+        therefore their window state. A file that fails validation (or fails
+        to compile for any other reason) keeps its previously loaded version,
+        if any, so a bad edit never drops a rule or blocks the other files.
+        """
+        with self._lock:
+            snapshot = self._scan()
+            current = self.ruleset
+            previous = {rule.source: rule for rule in current}
+            rules = []
+            seen = set()
+
+            for path in snapshot:
+                try:
+                    spec, fingerprint = self._compile_file(path)
+                    old = previous.get(path)
+                    if old is not None and old.fingerprint == fingerprint:
+                        rule = old
+                    else:
+                        rule = RULE_TYPES[spec.get('type', 'threshold')](spec, path, fingerprint)
+                except Exception as e:
+                    # Validation should catch bad specs; anything it misses
+                    # still only rejects this one file
+                    self.logger.error(f"Rejected rule file {path}: {str(e)}")
+                    rule = previous.get(path)
+                    if rule is None:
+                        continue
+
+                if rule.id in seen:
+                    self.logger.error(f"Duplicate rule id {rule.id} in {path}, skipping")
+                    continue
+                seen.add(rule.id)
+                rules.append(rule)
+
+            self._snapshot = snapshot
+            self.ruleset = RuleSet(rules, current.generation + 1)
+
+        self.logger.info(
+            f"Loaded {len(rules)} correlation rules (generation {self.ruleset.generation})")
+        return self.ruleset
+
+    def watch(self):
+        """Poll the rule directory in the background and reload on change"""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch_loop, daemon=True)
+            self._watcher.start()
+
+    def _watch_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self._scan() != self._snapshot:
+                    self.reload()
+            except Exception as e:
+                self.logger.error(f"Rule watch error: {str(e)}")
+
+    def stop(self):
+        self._stop.set()
@@ -1,29 +1,72 @@
 # AEGIS-SHIELD :: Oculus Sentry :: SIEM Core Engine
 # Path: /monitoring/oculus_sentry/siem_core.py
+import argparse
+import gzip
 import json
 import logging
+import signal
 import time
+from collections import defaultdict
 from datetime import datetime, timedelta
 from elasticsearch import Elasticsearch
 from kafka import KafkaConsumer
-import yaml
-import re
+from prometheus_client import start_http_server, Counter, Gauge, Histogram
 import hashlib
 
+from alert_suppressor import AlertSuppressor
+from ioc_enricher import IOCEnricher
+from response_executor import ResponseExecutor
+from rule_profiler import RuleProfiler
+from rule_repository import RuleRepository, event_time
+
 CODENAME = "SENTRY-CORE"
 VERSION = "4.2-SIEM"
 
+SUPPRESSION_WINDOW = 300  # seconds
+MAX_EVENT_SKEW = 60  # seconds an event's @timestamp may run ahead of the wall clock
+POLL_BATCH_SIZE = 500
+METRICS_PORT = 9091
+RULE_EVAL_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01)
+
 class OculusSentry:
-    def __init__(self):
+    def __init__(self, suppression_window=SUPPRESSION_WINDOW, offline=False,
+                 rule_timing_sample=1, enforce=False):
         self.logger = self._setup_logger()
-        self.es = Elasticsearch(['http://elastic:9200'])
-        self.rules = self._load_correlation_rules()
-        self.consumer = KafkaConsumer(
-            'security-events',
-            bootstrap_servers=['kafka:9092'],
-            auto_offset_reset='latest'
+        self.metrics = self._setup_metrics(serve=not offline)
+        self.rule_hits = defaultdict(int)
+        self.rule_misses = defaultdict(int)
+        self._reported = {'rule_hits': defaultdict(int), 'rule_misses': defaultdict(int)}
+        self.profiler = RuleProfiler(
+            histogram=self.metrics['rule_eval_time'],
+            sample_every=rule_timing_sample
+        )
+        self.rule_repo = self._load_correlation_rules(watch=not offline)
+        self.es = None
+        self.consumer = None
+        if not offline:
+            self.es = Elasticsearch(['http://elastic:9200'])
+            self.consumer = KafkaConsumer(
+                'security-events',
+                bootstrap_servers=['kafka:9092'],
+                auto_offset_reset='latest'
+            )
+        self.threat_cache = IOCEnricher(logger=self.logger)
+        self.suppressor = AlertSuppressor(
+            window=suppression_window,
+            metrics=self.metrics
         )
-        self.threat_cache = {}
+        self.metrics['suppression_entries'].set_function(lambda: len(self.suppressor))
+        # Newest event time seen, and the wall time it was seen at
+        self.event_clock = 0.0
+        self.event_clock_at = time.time()
+        self.responder = ResponseExecutor(
+            dry_run=not enforce,
+            metrics=self.metrics,
+            logger=self.logger
+        )
+        self.metrics['response_queue_depth'].set_function(self.responder.queue.qsize)
+        if not offline:
+            self.responder.start()
 
     def _setup_logger(self):
         logging.basicConfig(
@@ -33,72 +76,121 @@ class OculusSentry:
         )
         return logging.getLogger(CODENAME)
 
-    def _load_correlation_rules(self):
-        rules = []
-        rule_files = [
-            'monitoring/oculus_sentry/correlation_rules/brute_force.yaml',
-            'monitoring/oculus_sentry/correlation_rules/lateral_movement.yaml'
-        ]
-        
-        for rule_file in rule_files:
-            with open(rule_file) as f:
-                rules.append(yaml.safe_load(f))
-        
-        self.logger.info(f"Loaded {len(rules)} correlation rules")
-        return rules
-
-    def _match_rule(self, event, rule):
-        """Check if event matches correlation rule conditions"""
-        # Field matching
-        for condition in rule['conditions']:
-            field_value = event.get(condition['field'])
-            if not field_value:
-                return False
-            
-            if condition['type'] == 'regex':
-                if not re.match(condition['pattern'], str(field_value)):
-                    return False
-            elif condition['type'] == 'equals':
-                if str(field_value) != condition['value']:
-                    return False
-        
-        # Temporal conditions
-        if 'timeframe' in rule:
-            similar_events = self.es.search(
-                index='security-events',
-                body={
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {"match": {"source.ip": event['source']['ip']}},
-                                {"range": {
-                                    "@timestamp": {
-                                        "gte": f"now-{rule['timeframe']}m/m",
-                                        "lte": "now/m"
-                                    }
-                                }}
-                            ]
-                        }
-                    }
-                }
+    def _setup_metrics(self, serve=True):
+        metrics = {
+            'alerts_emitted': Counter(
+                'sentry_alerts_emitted_total',
+                'Alerts emitted after suppression',
+                ['rule']
+            ),
+            'alerts_suppressed': Counter(
+                'sentry_alerts_suppressed_total',
+                'Repeat alerts folded into an open alert',
+                ['rule']
+            ),
+            'suppression_evictions': Counter(
+                'sentry_suppression_evictions_total',
+                'Suppression entries evicted before their window closed'
+            ),
+            'suppression_entries': Gauge(
+                'sentry_suppression_entries',
+                'Open (rule, entity) suppression entries'
+            ),
+            'rule_eval_time': Histogram(
+                'sentry_rule_eval_seconds',
+                'Per-rule evaluation time (sampled)',
+                ['rule'],
+                buckets=RULE_EVAL_BUCKETS
+            ),
+            'rule_hits': Counter(
+                'sentry_rule_hits_total',
+                'Events matching a rule',
+                ['rule']
+            ),
+            'rule_misses': Counter(
+                'sentry_rule_misses_total',
+                'Events evaluated against a rule without matching',
+                ['rule']
+            ),
+            'stage_time': Histogram(
+                'sentry_stage_seconds',
+                'Pipeline stage time per Kafka batch (decode, enrich, match) or call (store, respond)',
+                ['stage']
+            ),
+            'response_submitted': Counter(
+                'sentry_response_submitted_total',
+                'Alerts queued for response actions'
+            ),
+            'response_dropped': Counter(
+                'sentry_response_dropped_total',
+                'Alerts dropped because the response queue was full'
+            ),
+            'response_coalesced': Counter(
+                'sentry_response_coalesced_total',
+                'Block requests for IPs already pending or blocked'
+            ),
+            'response_rejected': Counter(
+                'sentry_response_rejected_total',
+                'Block requests refused because the source IP was not valid IPv4'
+            ),
+            'response_blocked': Counter(
+                'sentry_response_blocked_total',
+                'IPs added to the blocklist'
+            ),
+            'response_failures': Counter(
+                'sentry_response_failures_total',
+                'Failed response actions or blocklist applies'
+            ),
+            'response_apply_time': Histogram(
+                'sentry_response_apply_seconds',
+                'Time to apply one blocklist batch'
+            ),
+            'response_queue_depth': Gauge(
+                'sentry_response_queue_depth',
+                'Alerts waiting for a response worker'
+            ),
+            'alert_latency': Histogram(
+                'sentry_alert_latency_seconds',
+                'Event @timestamp to alert stored',
+                buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
             )
-            if similar_events['hits']['total']['value'] < rule['threshold']:
-                return False
-        
-        return True
+        }
+
+        if serve:
+            start_http_server(METRICS_PORT)
+        return metrics
+
+    def _load_correlation_rules(self, watch=True):
+        repo = RuleRepository(logger=self.logger)
+        repo.reload()
+        if watch:
+            repo.watch()
+        return repo
 
-    def _generate_alert(self, event, rule):
+    def _match_rule(self, event, rule, now):
+        """Check if event matches correlation rule conditions and window"""
+        return rule.evaluate(event, now)
+
+    def _generate_alert(self, event, rule, entity=None):
         """Create enriched security alert"""
+        # The ES document id: unique per (rule, entity, first occurrence) so
+        # alerts for different entities at the same instant never overwrite
+        # each other, yet stable across replays of the same events
         alert_id = hashlib.sha256(
-            f"{event['@timestamp']}-{rule['id']}".encode()
+            f"{rule.id}-{entity}-{event['@timestamp']}".encode()
         ).hexdigest()
         
         return {
             "alert_id": alert_id,
             "timestamp": datetime.utcnow().isoformat(),
-            "rule": rule['id'],
-            "severity": rule['severity'],
+            "rule": rule.id,
+            "severity": rule.severity,
+            "actions": rule.actions,
             "event": event,
+            "ioc_matches": event.get('ioc_matches', []),
+            "count": 1,
+            "first_seen": event['@timestamp'],
+            "last_seen": event['@timestamp'],
             "codename": CODENAME,
             "version": VERSION,
             "status": "open"
@@ -107,34 +199,210 @@ class OculusSentry:
     def process_events(self):
         """Main processing loop"""
         self.logger.info(f"Starting {CODENAME} (v{VERSION}) event processing")
-        for message in self.consumer:
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.profiler.dump(self.logger))
+        stage = self.metrics['stage_time']
+        while True:
+            batch = self.consumer.poll(timeout_ms=1000, max_records=POLL_BATCH_SIZE)
             try:
-                event = json.loads(message.value.decode('utf-8'))
-                
-                for rule in self.rules:
-                    if self._match_rule(event, rule):
-                        alert = self._generate_alert(event, rule)
-                        self._store_alert(alert)
-                        self._trigger_response(alert)
+                # Suppression is on event time like the rule windows. Idle
+                # wall time only counts once the consumer has caught up (an
+                # empty poll), so a backlog never closes entries early.
+                clock = self.event_clock
+                if not batch and clock:
+                    clock += time.time() - self.event_clock_at
+                for summary in self.suppressor.expire(clock):
+                    self._store_alert(summary)
             except Exception as e:
-                self.logger.error(f"Processing error: {str(e)}")
+                self.logger.error(f"Alert summary error: {str(e)}")
+            if not batch:
+                continue
+            start = time.perf_counter()
+            events = []
+            for messages in batch.values():
+                for message in messages:
+                    try:
+                        events.append(json.loads(message.value.decode('utf-8')))
+                    except Exception as e:
+                        self.logger.error(f"Decode error: {str(e)}")
+            stage.labels(stage='decode').observe(time.perf_counter() - start)
+
+            now = time.time()
+            start = time.perf_counter()
+            try:
+                self.threat_cache.enrich_batch(events, now)
+            except Exception as e:
+                self.logger.error(f"Enrichment error: {str(e)}")
+            stage.labels(stage='enrich').observe(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for event in events:
+                try:
+                    # Windows, sequences and suppression run on event time, as
+                    # in replay; timestamps from the future are clamped
+                    occurred = min(event_time(event, now), now + MAX_EVENT_SKEW)
+                    if occurred > self.event_clock:
+                        self.event_clock = occurred
+                        self.event_clock_at = now
+                    self._process_event(event, occurred)
+                except Exception as e:
+                    self.logger.error(f"Processing error: {str(e)}")
+            # Store and respond time is observed separately and included here
+            stage.labels(stage='match').observe(time.perf_counter() - start)
+            self._flush_rule_counters()
+
+    def _process_event(self, event, now, store=None, respond=None):
+        store = store or self._store_alert
+        respond = respond or self._trigger_response
+        timed = self.profiler.should_sample()
+        # Snapshot the ruleset so a reload mid-event is never observed
+        for rule in self.rule_repo.ruleset:
+            if timed:
+                start = time.perf_counter()
+                matched = self._match_rule(event, rule, now)
+                self.profiler.record(rule.id, time.perf_counter() - start)
+            else:
+                matched = self._match_rule(event, rule, now)
+
+            if not matched:
+                self.rule_misses[rule.id] += 1
+            else:
+                self.rule_hits[rule.id] += 1
+                entity = rule.entity(event)
+                alert = self._generate_alert(event, rule, entity)
+                alert, closed = self.suppressor.offer(alert, entity, now)
+                for summary in closed:
+                    store(summary)
+                if alert:
+                    store(alert)
+                    respond(alert)
+
+    def _flush_rule_counters(self):
+        """Push hit/miss deltas to Prometheus once per batch, not per event"""
+        for name in ('rule_hits', 'rule_misses'):
+            reported = self._reported[name]
+            for rule_id, total in getattr(self, name).items():
+                delta = total - reported[rule_id]
+                if delta:
+                    self.metrics[name].labels(rule=rule_id).inc(delta)
+                    reported[rule_id] = total
+
+    def _read_replay_batches(self, paths):
+        """Yield decoded events from NDJSON (optionally gzipped) files"""
+        batch = []
+        for path in paths:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        batch.append(json.loads(line))
+                    except ValueError as e:
+                        self.logger.error(f"Replay decode error in {path}: {str(e)}")
+                        continue
+                    if len(batch) >= POLL_BATCH_SIZE:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+    def replay(self, paths, alerts_out):
+        """Backtest the rules on recorded events, writing alerts to a file.
+
+        Events go through the same enrichment, rule, window and suppression
+        path as live traffic, but windows advance on each event's
+        ``@timestamp`` rather than the wall clock, nothing is sent to
+        Elasticsearch and no response actions run. Aggregated alerts are
+        written again when their suppression entry closes, with the same
+        ``alert_id``. Returns a throughput and per-rule hit report.
+        """
+        self.logger.info(f"Replaying {len(paths)} file(s) through {CODENAME}")
+        self.rule_hits.clear()
+        self.rule_misses.clear()
+        self.profiler.reset()
+        events = 0
+        errors = 0
+        alerts = 0
+        now = 0.0
+
+        with open(alerts_out, 'w') as out:
+            def store(alert):
+                nonlocal alerts
+                alerts += 1
+                out.write(json.dumps(alert, default=str) + '\n')
+
+            start = time.perf_counter()
+            for batch in self._read_replay_batches(paths):
+                self.threat_cache.enrich_batch(batch, time.time())
+                for event in batch:
+                    events += 1
+                    now = event_time(event, now)
+                    try:
+                        self._process_event(event, now, store, respond=lambda alert: None)
+                    except Exception as e:
+                        errors += 1
+                        self.logger.error(f"Replay processing error: {str(e)}")
+                for summary in self.suppressor.expire(now):
+                    store(summary)
+            for summary in self.suppressor.flush():
+                store(summary)
+            elapsed = time.perf_counter() - start
+
+        report = {
+            'events': events,
+            'errors': errors,
+            'alerts_written': alerts,
+            'seconds': round(elapsed, 3),
+            'events_per_second': round(events / elapsed, 1) if elapsed else 0.0,
+            'rule_hits': dict(sorted(self.rule_hits.items(), key=lambda i: -i[1])),
+            'hottest_rules': self.profiler.hottest()
+        }
+        self.logger.info(f"Replay finished: {json.dumps(report)}")
+        return report
 
     def _store_alert(self, alert):
-        """Store alert in Elasticsearch"""
+        """Store alert in Elasticsearch, keyed so summaries overwrite it"""
+        start = time.perf_counter()
         self.es.index(
             index='security-alerts',
+            id=alert['alert_id'],
             body=alert
         )
-        self.logger.info(f"Generated alert {alert['alert_id']}")
+        self.metrics['stage_time'].labels(stage='store').observe(time.perf_counter() - start)
+        if alert['count'] > 1:
+            self.logger.info(
+                f"Updated alert {alert['alert_id']} ({alert['count']} occurrences)")
+        else:
+            self.logger.info(f"Generated alert {alert['alert_id']}")
+            occurred = event_time(alert['event'])
+            if occurred is not None:
+                self.metrics['alert_latency'].observe(time.time() - occurred)
 
     def _trigger_response(self, alert):
-        """Execute automated response actions"""
-        if alert['severity'] == 'critical':
-            # Example: Block IP via firewall
-            ip = alert['event']['source']['ip']
-            self.logger.warning(f"Blocking malicious IP: {ip}")
-            # os.system(f"iptables -A INPUT -s {ip} -j DROP")
+        """Hand critical alerts to the asynchronous response executor"""
+        with self.metrics['stage_time'].labels(stage='respond').time():
+            if alert['severity'] == 'critical':
+                if not self.responder.submit(alert):
+                    self.logger.error(f"Response queue full, dropped {alert['alert_id']}")
 
 if __name__ == "__main__":
-    sentry = OculusSentry()
-    sentry.process_events()
+    parser = argparse.ArgumentParser(description=f"{CODENAME} (v{VERSION})")
+    parser.add_argument('--replay', nargs='+', metavar='FILE',
+                        help='backtest rules on NDJSON or .ndjson.gz event files')
+    parser.add_argument('--alerts-out', default='replay_alerts.ndjson',
+                        help='alert output file for --replay')
+    parser.add_argument('--enforce', action='store_true',
+                        help='apply IP blocks with ipset instead of logging them')
+    parser.add_argument('--rule-timing-sample', type=int, default=1, metavar='N',
+                        help='time rule evaluation on one in N events')
+    args = parser.parse_args()
+
+    if args.replay:
+        sentry = OculusSentry(offline=True, rule_timing_sample=args.rule_timing_sample)
+        print(json.dumps(sentry.replay(args.replay, args.alerts_out), indent=2))
+    else:
+        sentry = OculusSentry(
+            rule_timing_sample=args.rule_timing_sample,
+            enforce=args.enforce
+        )
+        sentry.process_events()
@@ -0,0 +1,246 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Storage Sinks and Routing
+# Path: /monitoring/oculus_sentry/sinks.py
+import random
+import threading
+import time
+
+from bson import json_util
+from elasticsearch import helpers
+from pymongo.errors import BulkWriteError
+
+from bulk_writer import PartialWriteError
+
+# Behaviour before routing existed: every event goes to both stores
+DEFAULT_SINKS = {
+    'elasticsearch': {'type': 'elasticsearch', 'index': 'security-events'},
+    'mongo': {'type': 'mongo', 'collection': 'events'}
+}
+DEFAULT_ROUTES = [
+    {'sinks': ['elasticsearch', 'mongo']}
+]
+# Sink options that tune its BulkWriter rather than the sink itself
+WRITER_OPTIONS = ('queue_size', 'batch_size', 'flush_interval', 'workers')
+# Per-item errors meaning the document is already stored
+ES_CONFLICT = 409
+MONGO_DUPLICATE_KEY = 11000
+
+
+class Sink:
+    """A store written in batches by its own BulkWriter.
+
+    ``write`` receives a list of queued items and may return how many of
+    them were events actually stored (see BulkWriter).
+    """
+
+    kind = None
+
+    def __init__(self, name, options, metrics=None, logger=None):
+        self.name = name
+        self.options = options
+        self.logger = logger
+        self.store_time = metrics['stage_time'].labels(stage='store', source=name) if metrics else None
+
+    def write(self, items):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _timed(self, start_time):
+        if self.store_time is not None:
+            self.store_time.observe(time.time() - start_time)
+
+
+class ElasticsearchSink(Sink):
+    """Bulk-index events under their Mongo ``_id`` (so retries overwrite).
+
+    Per-item rejections that can succeed later (429 from a full write
+    queue, 5xx) are raised as a PartialWriteError for the writer to spool;
+    other 4xx rejections (mappings, bad documents) never will and are
+    logged and dropped. 409 conflicts mean the document is already there.
+    """
+
+    kind = 'elasticsearch'
+
+    def __init__(self, name, options, es=None, **kwargs):
+        super().__init__(name, options, **kwargs)
+        self.es = es
+        self.index = options.get('index', 'security-events')
+
+    def write(self, events):
+        start_time = time.time()
+        success, errors = helpers.bulk(
+            self.es,
+            ({
+                '_index': self.index,
+                '_id': str(event['_id']),
+                # Copied rather than popped so a failed batch spools intact
+                '_source': {k: v for k, v in event.items() if k != '_id'}
+            } for event in events),
+            raise_on_error=False
+        )
+        self._timed(start_time)
+        if not errors:
+            return len(events)
+
+        retry_ids = set()
+        dropped = 0
+        for error in errors:
+            item = next(iter(error.values()))
+            status = item.get('status', 0)
+            if status == ES_CONFLICT:
+                continue
+            if status == 429 or status >= 500:
+                retry_ids.add(item.get('_id'))
+            else:
+                dropped += 1
+        if dropped:
+            self.logger.error(f"Elasticsearch rejected {dropped} of {len(events)} events permanently")
+        if retry_ids:
+            retry = [event for event in events if str(event['_id']) in retry_ids]
+            raise PartialWriteError(
+                f"Elasticsearch asked to retry {len(retry)} of {len(events)} events",
+                retry, len(events) - len(retry))
+        return len(events)
+
+
+class MongoSink(Sink):
+    """Insert events and apply correlation acks for them.
+
+    Acks travel through the same FIFO queue as the events they refer to
+    and are applied after the inserts of their batch, so with a single
+    writer an ack can never overtake its event. Failed inserts other than
+    duplicate keys (already stored) are raised as a PartialWriteError
+    together with the batch's acks, which are then retried behind them.
+    """
+
+    kind = 'mongo'
+
+    def __init__(self, name, options, db=None, **kwargs):
+        super().__init__(name, options, **kwargs)
+        self.collection = db[options.get('collection', 'events')]
+
+    def write(self, items):
+        start_time = time.time()
+        events = []
+        acked = []
+        for item in items:
+            if '_ack' in item:
+                acked.extend(item['_ack'])
+            else:
+                events.append(item)
+
+        retry = []
+        if events:
+            try:
+                self.collection.insert_many(events, ordered=False)
+            except BulkWriteError as e:
+                retry = [
+                    events[error['index']] for error in e.details.get('writeErrors', [])
+                    if error.get('code') != MONGO_DUPLICATE_KEY
+                ]
+        if retry:
+            acks = [item for item in items if '_ack' in item]
+            self._timed(start_time)
+            raise PartialWriteError(
+                f"MongoDB failed {len(retry)} of {len(events)} inserts", retry + acks,
+                len(events) - len(retry))
+        if acked:
+            self.acknowledge(acked)
+        self._timed(start_time)
+        return len(events)
+
+    def acknowledge(self, ids):
+        self.collection.update_many(
+            {'_id': {'$in': ids}},
+            {'$set': {'processed': True}}
+        )
+
+
+class FileSink(Sink):
+    """Append events as NDJSON (``bson.json_util`` keeps ids and dates)"""
+
+    kind = 'file'
+
+    def __init__(self, name, options, **kwargs):
+        super().__init__(name, options, **kwargs)
+        self.path = options['path']
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, events):
+        lines = ''.join(json_util.dumps(event) + '\n' for event in events)
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+SINK_TYPES = {
+    'elasticsearch': ElasticsearchSink,
+    'mongo': MongoSink,
+    'file': FileSink
+}
+
+
+def build_sinks(config, es=None, db=None, metrics=None, logger=None):
+    """Instantiate ``{name: options}`` sink config into ``{name: Sink}``"""
+    sinks = {}
+    for name, options in config.items():
+        sink_type = SINK_TYPES.get(options.get('type'))
+        if sink_type is None:
+            raise ValueError(f"Sink {name}: unknown type {options.get('type')!r}")
+        extra = {'es': es} if sink_type is ElasticsearchSink else {'db': db} if sink_type is MongoSink else {}
+        sinks[name] = sink_type(name, options, metrics=metrics, logger=logger, **extra)
+    return sinks
+
+
+class Router:
+    """Pick the sinks for an event by its ``type``.
+
+    Routes are tried in order; a route with ``types`` matches those event
+    types and one without matches anything, so the first typeless route is
+    the default. ``sample`` keeps that fraction of matching events (the rest
+    are stored nowhere). The lookup is resolved once per type and cached.
+
+    ``route`` returns ``(sinks, ack_sink)``: ``ack_sink`` is the first Mongo
+    sink among ``sinks``, which is where correlation acks for the event must
+    go, or None when the event is not kept in Mongo.
+    """
+
+    def __init__(self, routes, sinks, metrics=None):
+        self.sinks = sinks
+        self.metrics = metrics
+        self.routes = []
+        for route in routes:
+            unknown = [name for name in route['sinks'] if name not in sinks]
+            if unknown:
+                raise ValueError(f"Route {route} names unknown sinks {unknown}")
+            ack_sink = next((name for name in route['sinks'] if sinks[name].kind == 'mongo'), None)
+            self.routes.append((
+                set(route['types']) if 'types' in route else None,
+                (tuple(route['sinks']), ack_sink),
+                float(route.get('sample', 1.0))
+            ))
+        self.by_type = {}
+
+    def _resolve(self, event_type):
+        for types, target, sample in self.routes:
+            if types is None or event_type in types:
+                return target, sample
+        return ((), None), 1.0
+
+    def route(self, event):
+        event_type = event.get('type')
+        resolved = self.by_type.get(event_type)
+        if resolved is None:
+            resolved = self.by_type[event_type] = self._resolve(event_type)
+        target, sample = resolved
+        if sample < 1.0 and random.random() >= sample:
+            if self.metrics:
+                self.metrics['events_sampled_out'].labels(type=str(event_type)).inc()
+            return (), None
+        return target
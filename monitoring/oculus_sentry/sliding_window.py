@@ -0,0 +1,69 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Sliding Window Counters
+# Path: /monitoring/oculus_sentry/sliding_window.py
+from collections import OrderedDict, deque
+
+
+class SlidingWindow:
+    """Per-key event counter over a trailing time horizon.
+
+    Keys are kept in least-recently-updated order so the oldest entries can
+    be expired from the front without scanning, and the key count is capped
+    at ``max_keys`` to keep memory bounded under high cardinality.
+    """
+
+    def __init__(self, horizon, max_keys=100000):
+        self.horizon = horizon
+        self.max_keys = max_keys
+        self.keys = OrderedDict()
+
+    def add(self, key, now):
+        """Record one event for ``key`` at ``now`` and return the window count"""
+        times = self.keys.get(key)
+        if times is None:
+            times = self.keys[key] = deque()
+            if len(self.keys) > self.max_keys:
+                self.keys.popitem(last=False)
+        else:
+            self.keys.move_to_end(key)
+
+        times.append(now)
+        cutoff = now - self.horizon
+        while times and times[0] <= cutoff:
+            times.popleft()
+
+        self.expire(now)
+        return len(times)
+
+    def count(self, key, now):
+        times = self.keys.get(key)
+        if not times:
+            return 0
+        cutoff = now - self.horizon
+        return sum(1 for t in times if t > cutoff)
+
+    def expire(self, now):
+        """Drop keys whose newest event has left the window"""
+        cutoff = now - self.horizon
+        while self.keys:
+            key, times = next(iter(self.keys.items()))
+            if times and times[-1] > cutoff:
+                break
+            self.keys.popitem(last=False)
+
+    def snapshot(self):
+        """JSON-serialisable ``[key, [times...]]`` pairs in LRU order"""
+        return [[key, list(times)] for key, times in self.keys.items()]
+
+    def restore(self, items, now):
+        """Reload a snapshot, dropping events that have since left the window"""
+        cutoff = now - self.horizon
+        self.keys.clear()
+        for key, times in items:
+            times = deque(t for t in times if t > cutoff)
+            if times:
+                self.keys[key] = times
+        while len(self.keys) > self.max_keys:
+            self.keys.popitem(last=False)
+
+    def __len__(self):
+        return len(self.keys)
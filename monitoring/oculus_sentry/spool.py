@@ -0,0 +1,217 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Disk Spool
+# Path: /monitoring/oculus_sentry/spool.py
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from bson import json_util
+
+# length, crc32 of the payload, time the record was spooled
+RECORD_HEADER = struct.Struct('!IId')
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+
+
+class Spool:
+    """Append-only, segmented on-disk queue.
+
+    Records are length-prefixed, CRC-checked JSON (``bson.json_util`` so
+    ObjectIds and dates survive the round trip) written to numbered segment
+    files that rotate at ``segment_bytes``. Writes are fsynced every
+    ``fsync_every`` records or ``fsync_interval`` seconds, whichever comes
+    first. ``append`` refuses items once ``max_bytes`` are pending.
+
+    Reading is cursor based: ``read`` returns a batch plus the position just
+    after it, and ``commit`` persists that position and deletes segments
+    that are fully consumed. The cursor file is replaced atomically but not
+    fsynced, so a crash can replay the last committed batch; the sinks
+    write by ``_id`` and tolerate that.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, max_bytes=1024 * 1024 * 1024,
+                 fsync_every=1000, fsync_interval=1.0, logger=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.logger = logger or logging.getLogger('Spool')
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                seq = int(name[:-len(SEGMENT_SUFFIX)])
+                self.sizes[seq] = os.path.getsize(self._path(seq))
+        self.cursor = self._load_cursor()
+        for seq in [s for s in self.sizes if s < self.cursor[0]]:
+            self._remove(seq)
+
+        # Never append to a segment left by a previous run: its tail may be torn
+        self.active = max(self.sizes, default=self.cursor[0] - 1) + 1
+        self.writer = None
+        self.reader = None
+        self.reader_seq = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.head_time = self._peek_time(self.cursor)
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"{seq:020d}{SEGMENT_SUFFIX}")
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            return min(self.sizes, default=0), 0
+
+    def _remove(self, seq):
+        if self.reader_seq == seq:
+            self.reader.close()
+            self.reader, self.reader_seq = None, None
+        try:
+            os.remove(self._path(seq))
+        except OSError as e:
+            self.logger.error(f"Spool segment removal error: {str(e)}")
+        self.sizes.pop(seq, None)
+
+    @property
+    def pending_bytes(self):
+        with self.lock:
+            return self._pending_bytes()
+
+    def _pending_bytes(self):
+        seq, offset = self.cursor
+        return max(0, sum(size for s, size in self.sizes.items() if s >= seq) - offset)
+
+    def age(self):
+        """Seconds since the oldest unread record was spooled"""
+        head_time = self.head_time
+        return time.time() - head_time if head_time else 0.0
+
+    def append(self, items):
+        """Spool ``items`` in order; returns False if the size cap is hit"""
+        now = time.time()
+        records = []
+        for item in items:
+            payload = json_util.dumps(item).encode('utf-8')
+            records.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload), now) + payload)
+        size = sum(len(record) for record in records)
+
+        with self.lock:
+            if self._pending_bytes() + size > self.max_bytes:
+                return False
+            if self.writer is None or self.sizes[self.active] >= self.segment_bytes:
+                self._rotate()
+            self.writer.write(b''.join(records))
+            self.sizes[self.active] += size
+            self.unsynced += len(records)
+            if self.head_time is None:
+                self.head_time = now
+            if (self.unsynced >= self.fsync_every
+                    or time.monotonic() - self.last_sync >= self.fsync_interval):
+                self._sync()
+        return True
+
+    def sync(self):
+        """fsync pending writes if the interval has passed"""
+        with self.lock:
+            if self.unsynced and time.monotonic() - self.last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        self.writer.flush()
+        os.fsync(self.writer.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def _rotate(self):
+        if self.writer is not None:
+            self._sync()
+            self.writer.close()
+        if self.active in self.sizes:
+            self.active += 1
+        self.writer = open(self._path(self.active), 'ab')
+        self.sizes[self.active] = 0
+
+    def _open(self, seq):
+        if self.reader_seq != seq:
+            if self.reader is not None:
+                self.reader.close()
+            self.reader = open(self._path(seq), 'rb')
+            self.reader_seq = seq
+        return self.reader
+
+    def _next_segment(self, seq):
+        later = [s for s in self.sizes if s > seq]
+        return min(later) if later else None
+
+    def _read_record(self, position):
+        """Return ``(payload, written_at, next_position)`` or None at the end"""
+        seq, offset = position
+        while True:
+            size = self.sizes.get(seq, 0)
+            if seq == self.active and self.writer is not None:
+                self.writer.flush()
+            if offset + RECORD_HEADER.size <= size:
+                f = self._open(seq)
+                f.seek(offset)
+                length, crc, written_at = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                payload = f.read(length)
+                if len(payload) == length and zlib.crc32(payload) == crc:
+                    return payload, written_at, (seq, offset + RECORD_HEADER.size + length)
+                self.logger.error(f"Spool: corrupt record in segment {seq} at {offset}, skipping segment")
+            elif offset < size and seq != self.active:
+                self.logger.error(f"Spool: truncated record in segment {seq} at {offset}, skipping segment")
+            nxt = self._next_segment(seq)
+            if nxt is None:
+                return None
+            seq, offset = nxt, 0
+
+    def _peek_time(self, position):
+        record = self._read_record(position)
+        return record[1] if record else None
+
+    def read(self, max_items=1000):
+        """Return ``(items, position)``; pass ``position`` to ``commit``"""
+        with self.lock:
+            items = []
+            position = self.cursor
+            while len(items) < max_items:
+                record = self._read_record(position)
+                if record is None:
+                    break
+                payload, _, position = record
+                items.append(json_util.loads(payload))
+            return items, position
+
+    def commit(self, position):
+        with self.lock:
+            self.cursor = position
+            tmp_file = os.path.join(self.directory, f"{CURSOR_FILE}.tmp")
+            with open(tmp_file, 'w') as f:
+                f.write(f"{position[0]} {position[1]}")
+            os.replace(tmp_file, os.path.join(self.directory, CURSOR_FILE))
+            for seq in [s for s in self.sizes if s < position[0] and s != self.active]:
+                self._remove(seq)
+            self.head_time = self._peek_time(position)
+
+    def empty(self):
+        with self.lock:
+            return self._pending_bytes() <= 0
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self._sync()
+                self.writer.close()
+                self.writer = None
+            if self.reader is not None:
+                self.reader.close()
+                self.reader, self.reader_seq = None, None
@@ -0,0 +1,155 @@
+# AEGIS-SHIELD :: Oculus Sentry :: Syslog Parser
+# Path: /monitoring/oculus_sentry/syslog_parser.py
+import re
+from datetime import datetime
+
+FACILITIES = (
+    'kern', 'user', 'mail', 'daemon', 'auth', 'syslog', 'lpr', 'news',
+    'uucp', 'cron', 'authpriv', 'ftp', 'ntp', 'security', 'console', 'solaris-cron',
+    'local0', 'local1', 'local2', 'local3', 'local4', 'local5', 'local6', 'local7'
+)
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+SEVERITIES = ('emerg', 'alert', 'crit', 'err', 'warning', 'notice', 'info', 'debug')
+
+# RFC 5424 default when a message carries no PRI: user.notice
+DEFAULT_PRI = 13
+
+RFC3164_HEADER = re.compile(
+    r'(?P<ts>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d) '
+    r'(?P<host>\S+) '
+    r'(?P<tag>[^:\[\s]+)(?:\[(?P<pid>[^\]]*)\])?: ?'
+)
+RFC3164_NO_HOST = re.compile(
+    r'(?P<ts>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d) '
+    r'(?P<tag>[^:\[\s]+)(?:\[(?P<pid>[^\]]*)\])?: ?'
+)
+SD_ELEMENT = re.compile(r'\[([^\s\]=]+)((?:\s+[^\s=\]]+="(?:\\.|[^"\\])*")*)\s*\]')
+SD_PARAM = re.compile(r'([^\s=\]]+)="((?:\\.|[^"\\])*)"')
+SD_UNESCAPE = re.compile(r'\\([\\"\]])')
+
+
+def _nil(value):
+    return None if value == '-' else value
+
+
+def _split_pri(text):
+    """Return (pri, rest) for a message starting with <PRI>"""
+    if text.startswith('<'):
+        end = text.find('>', 1, 5)
+        if end > 1 and text[1:end].isdigit():
+            pri = int(text[1:end])
+            if pri < 192:
+                return pri, text[end + 1:]
+    return None, text
+
+
+def _parse_structured_data(text):
+    """Parse SD-ELEMENTs; returns (list, remaining text).
+
+    Elements are kept as ``{'id': ..., 'params': [{'name': ..., 'value': ...}]}``
+    so SD-IDs and param names stay values: the Elasticsearch field set is
+    fixed whatever senders put on the wire, and repeated params survive.
+    """
+    if text.startswith('-'):
+        return [], text[2:] if text.startswith('- ') else text[1:]
+    elements = []
+    pos = 0
+    while pos < len(text) and text[pos] == '[':
+        match = SD_ELEMENT.match(text, pos)
+        if match is None:
+            break
+        elements.append({
+            'id': match.group(1),
+            'params': [
+                {'name': name, 'value': SD_UNESCAPE.sub(r'\1', value)}
+                for name, value in SD_PARAM.findall(match.group(2))
+            ]
+        })
+        pos = match.end()
+    rest = text[pos:]
+    return elements, rest[1:] if rest.startswith(' ') else rest
+
+
+def _rfc3164_time(stamp, now):
+    # "Mmm dd hh:mm:ss" sliced by hand; strptime dominates parse time otherwise
+    parsed = datetime(
+        now.year, MONTHS[stamp[:3]], int(stamp[4:6]),
+        int(stamp[7:9]), int(stamp[10:12]), int(stamp[13:15])
+    )
+    # No year on the wire: a date far in the future means last year's log
+    if (parsed - now).days > 1:
+        parsed = parsed.replace(year=now.year - 1)
+    return parsed.isoformat()
+
+
+def _parse_rfc5424(rest):
+    parts = rest.split(' ', 6)
+    if len(parts) < 7:
+        return None
+    _, timestamp, hostname, app_name, procid, msgid, tail = parts
+    structured, message = _parse_structured_data(tail)
+    if message.startswith('\ufeff'):
+        message = message[1:]
+    return {
+        'syslog_format': 'rfc5424',
+        'syslog_timestamp': _nil(timestamp),
+        'hostname': _nil(hostname),
+        'app_name': _nil(app_name),
+        'procid': _nil(procid),
+        'msgid': _nil(msgid),
+        'structured_data': structured,
+        'message': message
+    }
+
+
+def _parse_rfc3164(rest, now):
+    match = RFC3164_HEADER.match(rest) or RFC3164_NO_HOST.match(rest)
+    if match is None:
+        return None
+    fields = match.groupdict()
+    try:
+        timestamp = _rfc3164_time(fields['ts'], now)
+    except (KeyError, ValueError):
+        timestamp = None
+    return {
+        'syslog_format': 'rfc3164',
+        'syslog_timestamp': timestamp,
+        'hostname': fields.get('host'),
+        'app_name': fields['tag'],
+        'procid': fields['pid'],
+        'msgid': None,
+        'structured_data': [],
+        'message': rest[match.end():]
+    }
+
+
+def parse_syslog(data, now=None):
+    """Split a raw syslog datagram into typed fields.
+
+    RFC 5424 messages are recognised by the ``1 `` version after PRI and
+    take a plain split fast path; anything else is tried as RFC 3164 and,
+    failing that, kept as a raw message with only PRI decoded.
+    """
+    text = data.decode('utf-8', 'replace') if isinstance(data, bytes) else data
+    text = text.strip()
+    pri, rest = _split_pri(text)
+    if pri is None:
+        pri = DEFAULT_PRI
+
+    parsed = None
+    if rest[:2] == '1 ':
+        parsed = _parse_rfc5424(rest)
+    if parsed is None:
+        parsed = _parse_rfc3164(rest, now or datetime.utcnow())
+    if parsed is None:
+        parsed = {'syslog_format': 'raw', 'message': rest}
+
+    facility, severity = divmod(pri, 8)
+    parsed['facility'] = facility
+    parsed['facility_name'] = FACILITIES[facility] if facility < len(FACILITIES) else str(facility)
+    parsed['severity'] = severity
+    parsed['severity_name'] = SEVERITIES[severity]
+    return parsed
@@ -0,0 +1,194 @@
+# AEGIS-SHIELD :: Oculus Sentry :: High-Throughput Syslog Receiver
+# Path: /monitoring/oculus_sentry/syslog_receiver.py
+import asyncio
+import logging
+import multiprocessing
+import socket
+
+MAX_BATCH = 512
+MAX_FRAME = 64 * 1024
+DEFAULT_RCVBUF = 32 * 1024 * 1024
+
+
+def make_udp_socket(host, port, rcvbuf=DEFAULT_RCVBUF):
+    """Non-blocking UDP socket that shares its port with sibling workers"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # The kernel caps this at net.core.rmem_max; raise that sysctl to match
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.setblocking(False)
+    sock.bind((host, port))
+    return sock
+
+
+class BatchingDispatcher:
+    """Collect messages and hand them to ``handler`` once per loop pass.
+
+    Everything received during one event-loop iteration is delivered as a
+    single list, so per-message overhead in the handler is paid per batch.
+    """
+
+    def __init__(self, loop, handler, max_batch=MAX_BATCH):
+        self.loop = loop
+        self.handler = handler
+        self.max_batch = max_batch
+        self.batch = []
+        self.scheduled = False
+
+    def add(self, data, addr):
+        self.batch.append((data, addr))
+        if len(self.batch) >= self.max_batch:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        try:
+            self.handler(batch)
+        except Exception as e:
+            logging.getLogger('SyslogReceiver').error(f"Syslog handler error: {str(e)}")
+
+
+class SyslogDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def datagram_received(self, data, addr):
+        self.dispatcher.add(data, addr)
+
+
+class SyslogStreamProtocol(asyncio.Protocol):
+    """RFC 6587 TCP syslog with octet-counting or LF-delimited framing"""
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.buffer = bytearray()
+        self.addr = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('peername')
+
+    def data_received(self, data):
+        self.buffer.extend(data)
+        buf = self.buffer
+        pos = 0
+        end = len(buf)
+
+        while pos < end:
+            space = -1
+            if 48 <= buf[pos] <= 57:
+                space = buf.find(b' ', pos, min(end, pos + 10))
+                if space < 0 and end - pos < 10 and buf[pos:end].isdigit():
+                    break  # count not complete yet
+                if space >= 0 and not buf[pos:space].isdigit():
+                    space = -1
+            if space >= 0:
+                # Octet counting: "<len> <message>"
+                length = int(buf[pos:space])
+                if length > MAX_FRAME:
+                    return self._abort(f"frame of {length} bytes")
+                if space + 1 + length > end:
+                    break
+                self.dispatcher.add(bytes(buf[space + 1:space + 1 + length]), self.addr)
+                pos = space + 1 + length
+            else:
+                # Non-transparent framing: messages end at LF (including
+                # lines that merely start with a digit, e.g. a bare date)
+                newline = buf.find(b'\n', pos)
+                if newline < 0:
+                    if end - pos > MAX_FRAME:
+                        return self._abort("unterminated frame")
+                    break
+                if newline > pos:
+                    self.dispatcher.add(bytes(buf[pos:newline]).rstrip(b'\r'), self.addr)
+                pos = newline + 1
+
+        del buf[:pos]
+
+    def _abort(self, reason):
+        logging.getLogger('SyslogReceiver').warning(
+            f"Closing syslog TCP connection from {self.addr}: {reason}")
+        self.buffer.clear()
+        self.transport.close()
+
+
+class SyslogReceiver:
+    """asyncio syslog intake spread over SO_REUSEPORT sockets and processes.
+
+    Each worker process opens ``sockets_per_worker`` UDP sockets on the same
+    port (the kernel load-balances datagrams across them) plus, if
+    ``tcp_port`` is set, a reuse-port TCP listener. ``handler_factory`` is
+    called inside each worker with its index and must return a callable
+    taking a list of ``(data, addr)`` tuples; it must be picklable when
+    ``workers > 1``.
+    """
+
+    def __init__(self, handler_factory, host='0.0.0.0', udp_port=514, tcp_port=None,
+                 workers=1, sockets_per_worker=1, rcvbuf=DEFAULT_RCVBUF, logger=None):
+        self.handler_factory = handler_factory
+        self.workers = workers
+        self.settings = {
+            'host': host,
+            'udp_port': udp_port,
+            'tcp_port': tcp_port,
+            'sockets_per_worker': sockets_per_worker,
+            'rcvbuf': rcvbuf
+        }
+        self.logger = logger or logging.getLogger('SyslogReceiver')
+        self.processes = []
+
+    def serve_forever(self):
+        if self.workers <= 1:
+            run_worker(self.handler_factory, 0, self.settings)
+            return
+
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.workers):
+            process = context.Process(
+                target=run_worker,
+                args=(self.handler_factory, index, self.settings),
+                name=f"syslog-worker-{index}",
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+        self.logger.info(f"Started {self.workers} syslog worker processes")
+        for process in self.processes:
+            process.join()
+
+
+def run_worker(handler_factory, index, settings):
+    handler = handler_factory(index)
+    asyncio.run(_serve(handler, **settings))
+
+
+async def _serve(handler, host, udp_port, tcp_port, sockets_per_worker, rcvbuf):
+    loop = asyncio.get_running_loop()
+    dispatcher = BatchingDispatcher(loop, handler)
+
+    for _ in range(sockets_per_worker):
+        await loop.create_datagram_endpoint(
+            lambda: SyslogDatagramProtocol(dispatcher),
+            sock=make_udp_socket(host, udp_port, rcvbuf)
+        )
+
+    if tcp_port:
+        await loop.create_server(
+            lambda: SyslogStreamProtocol(dispatcher),
+            host,
+            tcp_port,
+            reuse_port=True
+        )
+
+    logging.getLogger('SyslogReceiver').info(
+        f"Syslog receiver listening on UDP {udp_port}"
+        + (f" and TCP {tcp_port}" if tcp_port else ""))
+    await asyncio.Event().wait()
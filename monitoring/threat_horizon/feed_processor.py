@@ -42,6 +42,10 @@ class ThreatProcessor:
                 is_active INTEGER
             )
         ''')
+        # Oculus Sentry's IOCEnricher looks indicators up by value in batches
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_iocs_value ON iocs(value, is_active)'
+        )
         self.conn.commit()
 
     def _load_feeds_config(self):
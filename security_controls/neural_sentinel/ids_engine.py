@@ -1,44 +1,98 @@
-import tensorflow as tf
-from tensorflow.keras.models import Model
-from tensorflow.keras.layers import Input, Dense, Dropout, LayerNormalization, MultiHeadAttention
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.losses import BinaryCrossentropy
-from tensorflow.keras.metrics import AUC, Precision, Recall
+import glob
+import importlib
+import os
+import tempfile
 import numpy as np
-import pandas as pd
 from sklearn.preprocessing import RobustScaler
 from sklearn.model_selection import train_test_split
 import joblib
 import warnings
 warnings.filterwarnings('ignore')
 
+MODEL_NAME = 'quantum_transformer_ids'
+ADVERSARIAL_NAME = 'adversarial_detector'
+SCALER_FILE = 'quantum_scaler.pkl'
+
+tf = None
+
+
+def _load_tf():
+    # TensorFlow takes seconds to import; only pay for it once a model is needed
+    global tf
+    if tf is None:
+        tf = importlib.import_module('tensorflow')
+    return tf
+
+
+def _model_path(model_dir, name):
+    # Native Keras file, legacy HDF5, or a SavedModel directory
+    for path in (f"{name}.keras", f"{name}.h5", name):
+        path = os.path.join(model_dir, path)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No saved model {name} in {model_dir}")
+
+
+def _list_shards(data_dir):
+    # X_<name>.npy features, each with a matching y_<name>.npy of labels
+    shards = []
+    for x_path in sorted(glob.glob(os.path.join(data_dir, 'X_*.npy'))):
+        y_path = os.path.join(data_dir, 'y_' + os.path.basename(x_path)[2:])
+        if not os.path.exists(y_path):
+            raise FileNotFoundError(f"Shard {x_path} has no labels at {y_path}")
+        shards.append((x_path, y_path))
+    return shards
+
+
 class QuantumTransformerIDS:
-    def __init__(self, input_shape=(42,), num_heads=6, ff_dim=128, num_layers=3, rate=0.1):
+    def __init__(self, input_shape=(42,), num_heads=6, ff_dim=128, num_layers=3, rate=0.1,
+                 jit_compile=False, build=True):
         self.input_shape = input_shape
         self.num_heads = num_heads
         self.ff_dim = ff_dim
         self.num_layers = num_layers
         self.rate = rate
+        self.jit_compile = jit_compile  # XLA for the fused inference graph
         self.scaler = RobustScaler()
         self.threshold = 0.98  # High precision threshold
-        self.model = self.build_quantum_transformer()
-        self.adversarial_model = self.build_adversarial_detector()
+        self.inference_fn = None
+        self.attack_fn = None
+        # build=False leaves the models to be loaded (see load())
+        self.model = self.build_quantum_transformer() if build else None
+        self.adversarial_model = self.build_adversarial_detector() if build else None
+
+    @classmethod
+    def load(cls, model_dir='.', warmup=True, **kwargs):
+        # Inference-only: weights and scaler from train(), optimizers not compiled
+        tf = _load_tf()
+        ids = cls(build=False, **kwargs)
+        ids.model = tf.keras.models.load_model(_model_path(model_dir, MODEL_NAME), compile=False)
+        ids.adversarial_model = tf.keras.models.load_model(
+            _model_path(model_dir, ADVERSARIAL_NAME), compile=False)
+        ids.scaler = joblib.load(os.path.join(model_dir, SCALER_FILE))
+        ids.input_shape = tuple(ids.model.input_shape[1:])
+        if warmup:
+            ids.compile_inference()
+        return ids
 
     def transformer_encoder(self, inputs):
+        layers = _load_tf().keras.layers
         # Self-attention layer
-        attention_output = MultiHeadAttention(
+        attention_output = layers.MultiHeadAttention(
             num_heads=self.num_heads, key_dim=self.input_shape[0])(inputs, inputs)
-        attention_output = Dropout(self.rate)(attention_output)
-        out1 = LayerNormalization(epsilon=1e-6)(inputs + attention_output)
+        attention_output = layers.Dropout(self.rate)(attention_output)
+        out1 = layers.LayerNormalization(epsilon=1e-6)(inputs + attention_output)
         
         # Feed-forward network
-        ffn_output = Dense(self.ff_dim, activation="gelu")(out1)
-        ffn_output = Dense(self.input_shape[0])(ffn_output)
-        ffn_output = Dropout(self.rate)(ffn_output)
-        return LayerNormalization(epsilon=1e-6)(out1 + ffn_output)
+        ffn_output = layers.Dense(self.ff_dim, activation="gelu")(out1)
+        ffn_output = layers.Dense(self.input_shape[0])(ffn_output)
+        ffn_output = layers.Dropout(self.rate)(ffn_output)
+        return layers.LayerNormalization(epsilon=1e-6)(out1 + ffn_output)
 
     def build_quantum_transformer(self):
-        inputs = Input(shape=self.input_shape)
+        tf = _load_tf()
+        layers = tf.keras.layers
+        inputs = layers.Input(shape=self.input_shape)
         x = inputs
         
         # Stack multiple transformer layers
@@ -46,40 +100,42 @@ class QuantumTransformerIDS:
             x = self.transformer_encoder(x)
         
         # Quantum-inspired dense layers
-        x = Dense(256, activation="selu")(x)
-        x = Dropout(0.3)(x)
-        x = Dense(128, activation="selu")(x)
-        x = Dropout(0.2)(x)
-        outputs = Dense(1, activation="sigmoid")(x)
+        x = layers.Dense(256, activation="selu")(x)
+        x = layers.Dropout(0.3)(x)
+        x = layers.Dense(128, activation="selu")(x)
+        x = layers.Dropout(0.2)(x)
+        outputs = layers.Dense(1, activation="sigmoid")(x)
         
         # Custom optimizer with quantum annealing-like behavior
-        optimizer = Adam(
+        optimizer = tf.keras.optimizers.Adam(
             learning_rate=tf.keras.optimizers.schedules.ExponentialDecay(
                 initial_learning_rate=1e-3,
                 decay_steps=10000,
                 decay_rate=0.9)
         )
         
-        model = Model(inputs=inputs, outputs=outputs)
+        model = tf.keras.Model(inputs=inputs, outputs=outputs)
         model.compile(
             optimizer=optimizer,
-            loss=BinaryCrossentropy(from_logits=False),
+            loss=tf.keras.losses.BinaryCrossentropy(from_logits=False),
             metrics=[
-                AUC(name='auc'),
-                Precision(name='precision'),
-                Recall(name='recall')
+                tf.keras.metrics.AUC(name='auc'),
+                tf.keras.metrics.Precision(name='precision'),
+                tf.keras.metrics.Recall(name='recall')
             ]
         )
         return model
 
     def build_adversarial_detector(self):
         # Separate model for detecting adversarial examples
-        inputs = Input(shape=self.input_shape)
-        x = Dense(64, activation="tanh")(inputs)
-        x = Dense(32, activation="tanh")(x)
-        outputs = Dense(1, activation="sigmoid")(x)
+        tf = _load_tf()
+        layers = tf.keras.layers
+        inputs = layers.Input(shape=self.input_shape)
+        x = layers.Dense(64, activation="tanh")(inputs)
+        x = layers.Dense(32, activation="tanh")(x)
+        outputs = layers.Dense(1, activation="sigmoid")(x)
         
-        model = Model(inputs=inputs, outputs=outputs)
+        model = tf.keras.Model(inputs=inputs, outputs=outputs)
         model.compile(
             optimizer="adam",
             loss="binary_crossentropy",
@@ -90,6 +146,7 @@ class QuantumTransformerIDS:
     def train(self, X, y, validation_split=0.2, epochs=100, batch_size=512):
         # Preprocess data
         X_scaled = self.scaler.fit_transform(X)
+        self.inference_fn = None  # scaler constants baked into the old graph
         X_train, X_val, y_train, y_val = train_test_split(
             X_scaled, y, test_size=validation_split, random_state=42
         )
@@ -100,68 +157,277 @@ class QuantumTransformerIDS:
             validation_data=(X_val, y_val),
             epochs=epochs,
             batch_size=batch_size,
-            callbacks=[
-                tf.keras.callbacks.EarlyStopping(
-                    monitor='val_auc',
-                    patience=5,
-                    mode='max',
-                    restore_best_weights=True
-                ),
-                tf.keras.callbacks.ReduceLROnPlateau(
-                    monitor='val_loss',
-                    factor=0.5,
-                    patience=3,
-                    min_lr=1e-6
-                )
-            ]
+            callbacks=self._callbacks()
         )
         
-        # Train adversarial detector
-        adv_X = self.generate_adversarial_samples(X_train)
-        adv_y = np.ones(len(adv_X))
+        # Train adversarial detector; samples are written straight after the
+        # clean rows instead of being stacked onto them afterwards
+        adv_train = np.empty((2 * len(X_train), X_train.shape[1]), dtype=np.float32)
+        adv_train[:len(X_train)] = X_train
+        self.generate_adversarial_samples(X_train, out=adv_train[len(X_train):])
         self.adversarial_model.fit(
-            np.vstack([X_train, adv_X]),
-            np.concatenate([np.zeros(len(X_train)), adv_y]),
+            adv_train,
+            np.concatenate([np.zeros(len(X_train)), np.ones(len(X_train))]),
             epochs=20,
             batch_size=256
         )
         
-        # Save models and scaler
-        self.model.save('quantum_transformer_ids.h5')
-        self.adversarial_model.save('adversarial_detector.h5')
-        joblib.dump(self.scaler, 'quantum_scaler.pkl')
-        
+        self.save()
+        return history
+
+    def train_from_shards(self, data_dir, validation_shards=1, epochs=100, batch_size=512,
+                          shuffle_buffer=100000, scaler_sample=1000000, adversarial_epochs=20,
+                          work_dir=None):
+        # Out-of-core variant of train(): streams memory-mapped shards from
+        # data_dir (see _list_shards) so the dataset never has to fit in RAM.
+        # The last validation_shards shards are held out for validation;
+        # adversarial shards are written to a temporary directory in work_dir.
+        shards = _list_shards(data_dir)
+        split = len(shards) - validation_shards
+        if split < 1:
+            raise ValueError(f"Need more than {validation_shards} shards in {data_dir}, found {len(shards)}")
+        train_shards, val_shards = shards[:split], shards[split:]
+
+        self.fit_scaler_from_shards(train_shards, scaler_sample)
+        history = self.model.fit(
+            self.shard_dataset(train_shards, batch_size, shuffle_buffer),
+            validation_data=self.shard_dataset(val_shards, batch_size, training=False) if val_shards else None,
+            epochs=epochs,
+            callbacks=self._callbacks()
+        )
+
+        # Adversarial detector: the main model is frozen now, so its FGSM
+        # rows are generated once and streamed next to the clean shards
+        with tempfile.TemporaryDirectory(dir=work_dir) as adv_dir:
+            adv_shards = self.write_adversarial_shards(train_shards, adv_dir)
+            self.adversarial_model.fit(
+                self.shard_dataset([(x_path, 0.0) for x_path, _ in train_shards] + adv_shards,
+                                   256, shuffle_buffer),
+                epochs=adversarial_epochs
+            )
+
+        self.save()
         return history
 
-    def generate_adversarial_samples(self, X, epsilon=0.1):
-        # Fast Gradient Sign Method for adversarial training
-        X_tensor = tf.convert_to_tensor(X, dtype=tf.float32)
-        with tf.GradientTape() as tape:
-            tape.watch(X_tensor)
-            prediction = self.model(X_tensor)
-            loss = BinaryCrossentropy()(
-                tf.ones_like(prediction), prediction)
-        gradient = tape.gradient(loss, X_tensor)
-        perturbation = epsilon * tf.sign(gradient)
-        return X + perturbation.numpy()
+    def write_adversarial_shards(self, shards, out_dir, block_size=65536):
+        # One memory-mapped adversarial shard per input shard. Rows are
+        # attacked in scaled space and stored back in raw feature space, so
+        # shard_dataset scales clean and adversarial rows alike.
+        adv_shards = []
+        for x_path, _ in shards:
+            X = np.load(x_path, mmap_mode='r')
+            path = os.path.join(out_dir, 'adv_' + os.path.basename(x_path))
+            out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=X.shape)
+            scaled = np.empty((min(block_size, len(X)), X.shape[1]), dtype=np.float32)
+            for start in range(0, len(X), block_size):
+                block = self.scaler.transform(X[start:start + block_size]).astype(np.float32)
+                adv_X = self.generate_adversarial_samples(block, out=scaled[:len(block)])
+                out[start:start + len(block)] = self.scaler.inverse_transform(adv_X)
+            out.flush()
+            del out
+            adv_shards.append((path, 1.0))
+        return adv_shards
+
+    def fit_scaler_from_shards(self, shards, sample_size=1000000, seed=42):
+        # RobustScaler needs medians and quantiles, so fit it on a uniform
+        # row sample drawn in one pass over the memory-mapped shards
+        rng = np.random.default_rng(seed)
+        sizes = [np.load(x_path, mmap_mode='r').shape[0] for x_path, _ in shards]
+        fraction = min(1.0, sample_size / max(1, sum(sizes)))
+        sample = []
+        for (x_path, _), size in zip(shards, sizes):
+            X = np.load(x_path, mmap_mode='r')
+            rows = np.sort(rng.integers(0, size, rng.binomial(size, fraction)))
+            sample.append(np.asarray(X[rows]))
+        self.scaler.fit(np.concatenate(sample))
+        self.inference_fn = None  # scaler constants baked into the old graph
+        return self.scaler
+
+    def shard_dataset(self, shards, batch_size=512, shuffle_buffer=100000, block_size=4096,
+                      training=True, seed=42):
+        # Shards are (features path, labels path or one constant label) pairs,
+        # read in contiguous blocks (sequential I/O on the memmap),
+        # interleaved across shards, shuffled row-wise in a bounded buffer,
+        # batched and then scaled in parallel on whole batches
+        tf = _load_tf()
+        n_features = self.input_shape[0]
+        center, scale = self._scaler_constants()
+
+        def read_blocks(index):
+            x_path, labels = shards[index]
+            X = np.load(x_path, mmap_mode='r')
+            y = np.load(labels, mmap_mode='r') if isinstance(labels, str) else None
+            starts = np.arange(0, len(X), block_size)
+            if training:
+                np.random.shuffle(starts)
+            for start in starts:
+                X_block = np.asarray(X[start:start + block_size], dtype=np.float32)
+                if y is None:
+                    y_block = np.full(len(X_block), labels, dtype=np.float32)
+                else:
+                    y_block = np.asarray(y[start:start + block_size], dtype=np.float32).reshape(-1)
+                yield X_block, y_block
+
+        def read_shard(index):
+            return tf.data.Dataset.from_generator(
+                read_blocks,
+                args=(index,),
+                output_signature=(
+                    tf.TensorSpec([None, n_features], tf.float32),
+                    tf.TensorSpec([None], tf.float32)
+                )
+            )
+
+        dataset = tf.data.Dataset.range(len(shards))
+        if training:
+            dataset = dataset.shuffle(len(shards), seed=seed)
+        dataset = dataset.interleave(
+            read_shard,
+            cycle_length=min(len(shards), 8),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=not training
+        ).unbatch()
+        if training:
+            dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+        dataset = dataset.batch(batch_size).map(
+            lambda x, y: ((x - center) / scale, y),
+            num_parallel_calls=tf.data.AUTOTUNE
+        )
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def _scaler_constants(self):
+        tf = _load_tf()
+        n_features = self.input_shape[0]
+        center = self.scaler.center_ if self.scaler.center_ is not None else np.zeros(n_features)
+        scale = self.scaler.scale_ if self.scaler.scale_ is not None else np.ones(n_features)
+        return tf.constant(center, dtype=tf.float32), tf.constant(scale, dtype=tf.float32)
+
+    def _callbacks(self):
+        tf = _load_tf()
+        return [
+            tf.keras.callbacks.EarlyStopping(
+                monitor='val_auc',
+                patience=5,
+                mode='max',
+                restore_best_weights=True
+            ),
+            tf.keras.callbacks.ReduceLROnPlateau(
+                monitor='val_loss',
+                factor=0.5,
+                patience=3,
+                min_lr=1e-6
+            )
+        ]
+
+    def save(self, model_dir='.'):
+        # Save models and scaler
+        self.model.save(os.path.join(model_dir, f"{MODEL_NAME}.h5"))
+        self.adversarial_model.save(os.path.join(model_dir, f"{ADVERSARIAL_NAME}.h5"))
+        joblib.dump(self.scaler, os.path.join(model_dir, SCALER_FILE))
+
+    def generate_adversarial_samples(self, X, epsilon=0.1, steps=1, step_size=None,
+                                     batch_size=4096, sample=None, out=None, seed=42):
+        # Fast Gradient Sign Method (steps=1) or PGD (steps>1) for adversarial
+        # training, run chunk by chunk through one compiled graph. epsilon may
+        # be a list: each value perturbs its own copy of the rows, stacked in
+        # order. sample (a fraction, or a row count) attacks a random subset.
+        # Results go into out (e.g. an np.memmap) or a new float32 array.
+        tf = _load_tf()
+        attack = self._attack_function()
+        epsilons = np.atleast_1d(np.asarray(epsilon, dtype=np.float32))
+        rows = None
+        if sample is not None:
+            count = sample if isinstance(sample, (int, np.integer)) else int(round(sample * len(X)))
+            rng = np.random.default_rng(seed)
+            rows = np.sort(rng.choice(len(X), min(count, len(X)), replace=False))
+        n_rows = len(X) if rows is None else len(rows)
+
+        shape = (n_rows * len(epsilons), X.shape[1])
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        elif out.shape != shape:
+            raise ValueError(f"out has shape {out.shape}, expected {shape}")
+
+        for i, eps in enumerate(epsilons):
+            step = eps if steps == 1 else (step_size or 2.5 * eps / steps)
+            eps, step = tf.constant(eps), tf.constant(step, dtype=tf.float32)
+            for start in range(0, n_rows, batch_size):
+                end = min(start + batch_size, n_rows)
+                chunk = X[start:end] if rows is None else X[rows[start:end]]
+                adv_chunk = attack(np.asarray(chunk, dtype=np.float32), eps, step, tf.constant(steps))
+                out[i * n_rows + start:i * n_rows + end] = adv_chunk.numpy()
+        return out
+
+    def _attack_function(self):
+        if self.attack_fn is not None:
+            return self.attack_fn
+        tf = _load_tf()
+        model = self.model
+        loss_fn = tf.keras.losses.BinaryCrossentropy()
+
+        @tf.function(input_signature=[
+            tf.TensorSpec([None, self.input_shape[0]], tf.float32),
+            tf.TensorSpec([], tf.float32),
+            tf.TensorSpec([], tf.float32),
+            tf.TensorSpec([], tf.int32)
+        ])
+        def attack(x, epsilon, step_size, steps):
+            x_adv = x
+            for _ in tf.range(steps):
+                with tf.GradientTape() as tape:
+                    tape.watch(x_adv)
+                    prediction = model(x_adv, training=False)
+                    loss = loss_fn(tf.ones_like(prediction), prediction)
+                x_adv = x_adv + step_size * tf.sign(tape.gradient(loss, x_adv))
+                # Project back into the epsilon ball around the clean rows
+                x_adv = tf.clip_by_value(x_adv, x - epsilon, x + epsilon)
+            return x_adv
+
+        self.attack_fn = attack
+        return attack
+
+    def compile_inference(self, jit_compile=None, warmup_sizes=(1, 1024)):
+        # One graph for scaling, both models, the blend and the threshold.
+        # RobustScaler statistics are folded in as constants, so the graph
+        # has to be rebuilt whenever the scaler is refit.
+        tf = _load_tf()
+        n_features = self.input_shape[0]
+        center, scale = self._scaler_constants()
+        model, adversarial_model = self.model, self.adversarial_model
+
+        @tf.function(
+            input_signature=[
+                tf.TensorSpec([None, n_features], tf.float32),
+                tf.TensorSpec([], tf.float32)
+            ],
+            jit_compile=self.jit_compile if jit_compile is None else jit_compile
+        )
+        def infer(x, threshold):
+            x = (x - center) / scale
+            main_pred = model(x, training=False)
+            adv_pred = adversarial_model(x, training=False)
+            anomaly_scores = 0.7 * main_pred + 0.3 * adv_pred
+            return anomaly_scores > threshold, anomaly_scores, main_pred, adv_pred
+
+        # Trace (and with XLA, compile per shape) before the first real request
+        for size in warmup_sizes:
+            infer(tf.zeros([size, n_features]), tf.constant(self.threshold, tf.float32))
+        self.inference_fn = infer
+        return infer
 
     def detect_anomalies(self, network_data):
-        # Preprocess data
-        data_scaled = self.scaler.transform(network_data)
-        
-        # Get predictions from both models
-        main_pred = self.model.predict(data_scaled)
-        adv_pred = self.adversarial_model.predict(data_scaled)
-        
-        # Combined anomaly score
-        anomaly_scores = 0.7 * main_pred + 0.3 * adv_pred
-        anomalies = anomaly_scores > self.threshold
+        if self.inference_fn is None:
+            self.compile_inference()
+
+        # Single graph call; no Keras predict() loop or host-side blending
+        anomalies, anomaly_scores, main_pred, adv_pred = self.inference_fn(
+            np.asarray(network_data, dtype=np.float32), np.float32(self.threshold))
         
         return {
-            'anomalies': anomalies,
-            'scores': anomaly_scores,
-            'main_scores': main_pred,
-            'adv_scores': adv_pred
+            'anomalies': anomalies.numpy(),
+            'scores': anomaly_scores.numpy(),
+            'main_scores': main_pred.numpy(),
+            'adv_scores': adv_pred.numpy()
         }
 
     def evaluate_attack(self, X_attack, y_attack):
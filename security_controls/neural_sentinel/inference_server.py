@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def bucket_sizes(max_batch, smallest=16):
+    """Powers of two from ``smallest`` up to (and capped at) ``max_batch``"""
+    sizes = []
+    size = smallest
+    while size < max_batch:
+        sizes.append(size)
+        size *= 2
+    sizes.append(max_batch)
+    return sizes
+
+
+class Overloaded(Exception):
+    """Raised by submit() when the request queue is full"""
+
+
+class InferenceServer:
+    """Dynamic micro-batching in front of QuantumTransformerIDS.
+
+    Callers submit one or more flows and get a Future back. A batcher
+    thread takes the first waiting request, keeps collecting until it has
+    ``max_batch`` rows or ``max_wait`` seconds have passed, scores the
+    stacked batch with a single model call and splits the results back to
+    each request's future. The request queue is bounded: when it is full
+    ``submit`` raises Overloaded immediately instead of letting latency
+    grow without limit.
+
+    XLA compiles one executable per batch size, so with ``pad`` (the
+    default when the IDS was built with ``jit_compile``) every batch is
+    zero-padded up to the next of a fixed set of bucket sizes, all of which
+    are compiled in ``start``, and the results are sliced back.
+    """
+
+    def __init__(self, ids, max_batch=1024, max_wait=0.002, queue_size=10000, pad=None,
+                 logger=None):
+        self.ids = ids
+        self.n_features = ids.input_shape[0]
+        self.max_batch = max_batch
+        if pad is None:
+            pad = getattr(ids, 'jit_compile', False)
+        self.buckets = bucket_sizes(max_batch) if pad else None
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.logger = logger or logging.getLogger('InferenceServer')
+        self.running = False
+        self.thread = None
+        self.carry = None  # request held over because it would overflow a batch
+        self.stats = {'requests': 0, 'rows': 0, 'batches': 0, 'rejected': 0, 'errors': 0}
+
+    def start(self):
+        if self.buckets is not None:
+            # Compile every bucket now rather than on the first batch of each size
+            self.ids.compile_inference(warmup_sizes=self.buckets)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='ids-batcher', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def submit(self, flows):
+        """Queue up to ``max_batch`` flows (one row or a 2-D array); returns a Future"""
+        rows = np.asarray(flows, dtype=np.float32)
+        if rows.ndim == 1:
+            rows = rows[np.newaxis, :]
+        if rows.ndim != 2 or rows.shape[1] != self.n_features:
+            raise ValueError(f"expected rows of {self.n_features} features, got shape {rows.shape}")
+        if len(rows) > self.max_batch:
+            raise ValueError(f"at most {self.max_batch} rows per request, got {len(rows)}")
+
+        future = Future()
+        try:
+            self.queue.put_nowait((rows, future))
+        except queue.Full:
+            self.stats['rejected'] += 1
+            raise Overloaded(f"{self.queue.qsize()} requests waiting")
+        return future
+
+    async def score(self, flows):
+        """asyncio wrapper around submit()"""
+        return await asyncio.wrap_future(self.submit(flows))
+
+    def _next_batch(self):
+        first, self.carry = self.carry, None
+        if first is None:
+            try:
+                first = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                return []
+        batch = [first]
+        rows = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if rows + len(item[0]) > self.max_batch:
+                # Starts the next batch, so no batch exceeds max_batch rows
+                self.carry = item
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while self.running or not self.queue.empty() or self.carry is not None:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            # Drop requests whose caller already cancelled them
+            batch = [(rows, future) for rows, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            data = batch[0][0] if len(batch) == 1 else np.concatenate([rows for rows, _ in batch])
+            try:
+                result = self._score(data)
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.logger.error(f"Batch of {len(data)} rows failed: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.stats['requests'] += len(batch)
+            self.stats['rows'] += len(data)
+            self.stats['batches'] += 1
+            offset = 0
+            for rows, future in batch:
+                end = offset + len(rows)
+                future.set_result({key: value[offset:end] for key, value in result.items()})
+                offset = end
+
+
+    def _score(self, data):
+        if self.buckets is None:
+            return self.ids.detect_anomalies(data)
+        largest = self.buckets[-1]
+        parts = []
+        for start in range(0, len(data), largest):
+            chunk = data[start:start + largest]
+            rows = len(chunk)
+            size = next(bucket for bucket in self.buckets if bucket >= rows)
+            if size > rows:
+                chunk = np.concatenate([chunk, np.zeros((size - rows, self.n_features), dtype=np.float32)])
+            result = self.ids.detect_anomalies(chunk)
+            parts.append({key: value[:rows] for key, value in result.items()})
+        if len(parts) == 1:
+            return parts[0]
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """POST /score with {"flows": [[...], ...]}; GET /health for stats"""
+
+    server_version = 'NeuralSentinel/1.0'
+    inference = None
+    timeout_seconds = 5.0
+    max_body_bytes = 1 << 20
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._reply(404, {'error': 'not found'})
+            return
+        stats = dict(self.inference.stats, queue_depth=self.inference.queue.qsize())
+        self._reply(200, stats)
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self._reply(400, {'error': 'bad Content-Length'})
+            return
+        if length < 0 or length > self.max_body_bytes:
+            self.close_connection = True
+            self._reply(413, {'error': f"body over {self.max_body_bytes} bytes"})
+            return
+        try:
+            flows = json.loads(self.rfile.read(length))['flows']
+            future = self.inference.submit(flows)
+        except Overloaded as e:
+            self._reply(503, {'error': f"overloaded: {str(e)}"}, {'Retry-After': '1'})
+            return
+        except (KeyError, ValueError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+
+        try:
+            result = future.result(timeout=self.timeout_seconds)
+        except FutureTimeout:
+            # Nobody will read the result: drop it from its batch if not yet scored
+            future.cancel()
+            self._reply(504, {'error': f"not scored within {self.timeout_seconds}s"})
+            return
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, {
+            'scores': result['scores'].ravel().tolist(),
+            'anomalies': result['anomalies'].ravel().tolist()
+        })
+
+
+def serve(inference, host='127.0.0.1', port=8500, timeout=5.0):
+    handler = type('BoundScoringHandler', (ScoringHandler,), {
+        'inference': inference,
+        'timeout_seconds': timeout,
+        # A full request of max_batch rows as JSON, with room for long floats
+        'max_body_bytes': inference.max_batch * inference.n_features * 32 + 4096
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def load_ids(model_dir='.', jit_compile=False):
+    from ids_engine import QuantumTransformerIDS
+
+    # With XLA the server warms its own bucket sizes in start()
+    return QuantumTransformerIDS.load(model_dir, warmup=not jit_compile, jit_compile=jit_compile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-batching IDS scoring service')
+    parser.add_argument('--model-dir', default='.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--max-batch', type=int, default=1024)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--xla', action='store_true', help='XLA-compile the inference graph')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    inference = InferenceServer(
+        load_ids(args.model_dir, jit_compile=args.xla),
+        max_batch=args.max_batch,
+        max_wait=args.max_wait_ms / 1000.0,
+        queue_size=args.queue_size
+    ).start()
+    server = serve(inference, args.host, args.port)
+    logging.getLogger('InferenceServer').info(f"Scoring on http://{args.host}:{args.port}/score")
+    try:
+        server.serve_forever()
+    finally:
+        inference.stop()